@@ -6,7 +6,20 @@ import json
 import aiohttp
 import async_timeout
 import time
+import os
 import os.path
+import hashlib
+import cProfile
+import pstats
+import sys
+import threading
+import collections
+import functools
+import bisect
+import difflib
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
 
 """
 Support to interface with the Roon API.
@@ -20,11 +33,21 @@ from homeassistant.components.media_player import (
     MEDIA_TYPE_MUSIC, SUPPORT_NEXT_TRACK, SUPPORT_PAUSE, PLATFORM_SCHEMA,
     SUPPORT_PREVIOUS_TRACK, SUPPORT_SEEK, SUPPORT_TURN_OFF, SUPPORT_TURN_ON,
     SUPPORT_VOLUME_MUTE, SUPPORT_VOLUME_SET, SUPPORT_PLAY, MediaPlayerDevice)
+try:
+    from homeassistant.components.media_player import BrowseMedia
+    from homeassistant.components.media_player.const import (
+        MEDIA_CLASS_DIRECTORY, MEDIA_CLASS_MUSIC, SUPPORT_BROWSE_MEDIA)
+    from homeassistant.components.media_player.errors import BrowseError
+except ImportError:
+    # the media browser needs Home Assistant 0.115 or newer
+    BrowseMedia = BrowseError = MEDIA_CLASS_DIRECTORY = MEDIA_CLASS_MUSIC = None
+    SUPPORT_BROWSE_MEDIA = 0
 from homeassistant.const import (
     STATE_IDLE, STATE_OFF, STATE_PAUSED, STATE_PLAYING,
-    CONF_HOST, CONF_PORT, CONF_SSL, CONF_API_KEY, DEVICE_DEFAULT_NAME,
+    CONF_HOST, CONF_PORT, CONF_SSL, CONF_API_KEY, DEVICE_DEFAULT_NAME, ATTR_ENTITY_ID,
     EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP)
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.util import slugify
 from homeassistant.util.dt import utcnow
 import homeassistant.helpers.config_validation as cv
 from homeassistant.core import callback
@@ -34,40 +57,141 @@ from homeassistant.helpers.discovery import load_platform
 try:
     ensure_future = asyncio.ensure_future
 except AttributeError:
-    # Python 3.4.3 and earlier has this as async
-    ensure_future = asyncio.async
+    # Python 3.4.3 and earlier has this as async, which is a keyword since Python 3.7
+    ensure_future = getattr(asyncio, "async")
 
 
 _LOGGER = logging.getLogger(__name__)
 
 REQUIREMENTS = ['roonapi>=0.0.20']
 
+DOMAIN = 'roon'
 TOKEN_FILE = '.roontoken'
+STATE_FILE = '.roonstate'
+LIBRARY_FILE = '.roonlibrary'
+ARTWORK_DIR = '.roon_artwork'
 
 TIMEOUT = 10
 UPDATE_PLAYLISTS_INTERVAL = 360
+UPDATE_WINDOW = 0.25
+MAX_UPDATE_WINDOW = 2.0
+UPDATE_SLICE = 0.02
+SEEK_TOLERANCE = 2
+CATALOG_TTL = 300
+WATCHDOG_INTERVAL = 10
+WATCHDOG_IDLE = 20
+WATCHDOG_TIMEOUT = 5
+WATCHDOG_FAILURES = 2
+WATCHDOG_SESSION = 'hass_watchdog'
+RECONNECT_MIN_DELAY = 2
+RECONNECT_MAX_DELAY = 120
+COMMAND_WORKERS = 4
+VOLUME_RATE_LIMIT = 0.2
+VOLUME_SETTLE_TIME = 1.5
+VOLUME_SLIDER = "input_number.roon_volume"
+IMAGE_URL_CACHE_SIZE = 500
+ARTWORK_SIZE = 500
+ARTWORK_CACHE_SIZE = 50
+DIAGNOSTICS_ENTITY = "sensor.roon_diagnostics"
+DIAGNOSTICS_INTERVAL = 60
+METRICS_SAMPLES = 256
+PROVISIONAL_TIMEOUT = 120
+STATE_VERSION = 1
+LIBRARY_VERSION = 1
+LIBRARY_TTL = 3600
+LIBRARY_PAGE_SIZE = 100
+LIBRARY_SESSION = 'hass_library'
+LIBRARY_MATCH_CUTOFF = 0.6
+LIBRARY_MATCH_CANDIDATES = 50
+# media type: browse path of the list in the roon library
+LIBRARY_LISTS = (
+    ("artist", ("Library", "Artists")),
+    ("album", ("Library", "Albums")),
+    ("track", ("Library", "Tracks")),
+    ("playlist", ("Playlists",)),
+    ("radio", ("Internet Radio",)),
+)
+# media type: category in the search results
+SEARCH_CATEGORIES = {"artist": "Artists", "album": "Albums", "track": "Tracks"}
+BROWSE_SESSION = 'hass_browse'
+BROWSE_PAGE_SIZE = 100
+BROWSE_CACHE_SIZE = 200
+BROWSE_TTL = 300
+BROWSE_ROOT = 'root'
+# media_content_id of a page after the first one: item key, separator, offset
+BROWSE_PAGE_SEPARATOR = '|'
+MEDIA_TYPE_LIBRARY = 'library'
 CONF_CUSTOM_PLAY_ACTION = 'custom_play_action'
 CONF_SOURCE_CONTROLS = 'source_controls'
 CONF_VOLUME_CONTROLS = 'volume_controls'
+CONF_UPDATE_WINDOW = 'update_window'
+CONF_ARTWORK_CACHE = 'artwork_cache'
+CONF_ARTWORK_CACHE_SIZE = 'artwork_cache_size'
+CONF_TRACE_FILE = 'trace_file'
+CONF_LIBRARY_INDEX = 'library_index'
+SERVICE_PROFILE = 'profile'
+SERVICE_JOIN = 'join'
+SERVICE_UNJOIN = 'unjoin'
+SERVICE_MULTI_COMMAND = 'multi_command'
+ATTR_SECONDS = 'seconds'
+ATTR_MASTER = 'master'
+ATTR_COMMAND = 'command'
+ATTR_VOLUME_LEVEL = 'volume_level'
+EVENT_MULTI_COMMAND_RESULT = 'roon_multi_command_result'
+# playback commands apply to the whole zone, they are sent once per zone
+ZONE_COMMANDS = ["play", "pause", "playpause", "stop", "next", "previous"]
+OUTPUT_COMMANDS = ["mute", "unmute", "volume_set", "volume_up", "volume_down", "standby", "turn_on"]
 
 SUPPORT_ROON = SUPPORT_PAUSE | SUPPORT_VOLUME_SET | SUPPORT_STOP | \
     SUPPORT_PREVIOUS_TRACK | SUPPORT_NEXT_TRACK | SUPPORT_SHUFFLE_SET | \
     SUPPORT_SEEK | SUPPORT_TURN_ON | SUPPORT_TURN_OFF | SUPPORT_VOLUME_MUTE | \
-    SUPPORT_PLAY | SUPPORT_PLAY_MEDIA | SUPPORT_SELECT_SOURCE
+    SUPPORT_PLAY | SUPPORT_PLAY_MEDIA | SUPPORT_SELECT_SOURCE | SUPPORT_BROWSE_MEDIA
 
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
-    vol.Optional(CONF_HOST): cv.string,
+    vol.Optional(CONF_HOST): vol.All(cv.ensure_list, [cv.string]),
     vol.Optional(CONF_CUSTOM_PLAY_ACTION): cv.string,
     vol.Optional(CONF_SOURCE_CONTROLS): cv.entity_ids,
     vol.Optional(CONF_VOLUME_CONTROLS): cv.entity_ids,
+    vol.Optional(CONF_UPDATE_WINDOW, default=UPDATE_WINDOW): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional(CONF_ARTWORK_CACHE, default=False): cv.boolean,
+    vol.Optional(CONF_ARTWORK_CACHE_SIZE, default=ARTWORK_CACHE_SIZE): cv.positive_int,
+    vol.Optional(CONF_TRACE_FILE): cv.string,
+    vol.Optional(CONF_LIBRARY_INDEX, default=False): cv.boolean,
+})
+
+PROFILE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_SECONDS, default=60): vol.All(vol.Coerce(float), vol.Range(min=1, max=3600)),
 })
 
+JOIN_SCHEMA = vol.Schema({
+    vol.Required(ATTR_MASTER): cv.entity_id,
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+})
+
+UNJOIN_SCHEMA = vol.Schema({
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+})
+
+# volume_set needs the volume level, the other commands don't take one
+MULTI_COMMAND_SCHEMA = vol.Any(
+    vol.Schema({
+        vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+        vol.Required(ATTR_COMMAND): "volume_set",
+        vol.Required(ATTR_VOLUME_LEVEL): vol.All(vol.Coerce(float), vol.Range(min=0, max=1)),
+    }),
+    vol.Schema({
+        vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+        vol.Required(ATTR_COMMAND): vol.In([command for command in ZONE_COMMANDS + OUTPUT_COMMANDS
+                if command != "volume_set"]),
+    }),
+)
+
 
 @asyncio.coroutine
 def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
     """Set up the Roon platform."""
-    host = config.get(CONF_HOST)
+    hosts = config.get(CONF_HOST) or [None]
     custom_play_action = config.get(CONF_CUSTOM_PLAY_ACTION)
     from roon import RoonApi
     appinfo = {
@@ -78,32 +202,233 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
             "email": "marcelveldt@users.noreply.github.com",
             "website": "https://github.com/marcelveldt/roon-hass"
         }
-    token = None
-    token_file = hass.config.path(TOKEN_FILE)
-    _LOGGER.debug("token file location: %s" % token_file)
-    if os.path.isfile(token_file):
-        with open(token_file) as f:
-            token = f.read()
-    if not token:
-        _LOGGER.warning("App not yet registered within Roon. You should allow it in Roon's settings.")
-
     source_controls = config.get(CONF_SOURCE_CONTROLS)
     volume_controls = config.get(CONF_VOLUME_CONTROLS)
-
-    roonapi = RoonApi(appinfo, token, host, blocking_init=False)
-    roon = RoonServer(hass, roonapi, async_add_devices, custom_play_action, source_controls, volume_controls)
+    update_window = config.get(CONF_UPDATE_WINDOW)
+    artwork_cache_size = 0
+    if config.get(CONF_ARTWORK_CACHE):
+        # size is configured in MB
+        artwork_cache_size = config.get(CONF_ARTWORK_CACHE_SIZE) * 1024 * 1024
+    trace_file = config.get(CONF_TRACE_FILE)
+    if trace_file:
+        # record all roon events, relative paths are in the config directory
+        trace_file = hass.config.path(trace_file)
+        _LOGGER.warning("Recording Roon events to %s", trace_file)
+    # one profiler for all cores, only one profiler can be active in the event loop
+    profiler = RoonProfiler(hass)
+
+    servers = []
+    for index, host in enumerate(hosts):
+        # the first core keeps the file names and player ids of a single core setup,
+        # the other cores get their own namespace derived from the host
+        namespace = slugify(host) if index else None
+        suffix = "_%s" % namespace if namespace else ""
+        token = None
+        token_file = hass.config.path(TOKEN_FILE + suffix)
+        _LOGGER.debug("token file location: %s", token_file)
+        if os.path.isfile(token_file):
+            with open(token_file) as f:
+                token = f.read()
+        if not token:
+            _LOGGER.warning("App not yet registered within Roon%s. You should allow it in Roon's settings.",
+                    " (%s)" % host if host else "")
+
+        def connect(token, host=host):
+            """Create the connection to a core."""
+            return RoonApi(appinfo, token, host, blocking_init=False)
+
+        roonapi = connect(token)
+        core_trace_file = None
+        if trace_file:
+            name, ext = os.path.splitext(trace_file)
+            core_trace_file = name + suffix + ext
+        library_file = hass.config.path(LIBRARY_FILE + suffix) if config.get(CONF_LIBRARY_INDEX) else None
+        # source/volume controls and the player widget belong to the first core
+        roon = RoonServer(hass, roonapi, async_add_devices, custom_play_action,
+                source_controls if not index else None, volume_controls if not index else None,
+                update_window, artwork_cache_size, trace_file=core_trace_file,
+                state_file=hass.config.path(STATE_FILE + suffix), library_file=library_file,
+                namespace=namespace, host=host, profiler=profiler, connect=connect)
+        servers.append((roon, token_file))
+    # entities of the previous run are available right away, the live data from roon follows
+    yield from asyncio.gather(*[roon.async_restore_state() for roon, _ in servers])
 
     @asyncio.coroutine
     def stop_roon(event):
         """Stop Roon connection."""
         _LOGGER.debug("stop requested")
-        if roonapi.token:
-            open(token_file, 'w').write(roonapi.token)
-        roonapi.stop()
-        roon.stop_roon()
+        for roon, token_file in servers:
+            if roon.roonapi.token:
+                open(token_file, 'w').write(roon.roonapi.token)
+        yield from asyncio.gather(*[roon.async_save_state() for roon, _ in servers])
+        for roon, _ in servers:
+            roon.roonapi.stop()
+            roon.stop_roon()
+
+    def group_by_server(entity_ids):
+        """The given players per server of the core they belong to, unknown players go to the first one."""
+        groups = collections.OrderedDict()
+        for entity_id in entity_ids:
+            roon = next((roon for roon, _ in servers if roon.get_device_by_entity(entity_id)), servers[0][0])
+            groups.setdefault(roon, []).append(entity_id)
+        return groups
+
+    @asyncio.coroutine
+    def async_profile_service(service):
+        """Profile the integration for the given number of seconds."""
+        profiler.start(service.data[ATTR_SECONDS])
+
+    @asyncio.coroutine
+    def async_join_service(service):
+        """Group the given players with the zone of the master."""
+        master = service.data[ATTR_MASTER]
+        # grouping only works within a core
+        roon = next(iter(group_by_server([master])))
+        yield from roon.async_join(master, service.data[ATTR_ENTITY_ID])
 
+    @asyncio.coroutine
+    def async_unjoin_service(service):
+        """Ungroup the given players."""
+        yield from asyncio.gather(*[roon.async_unjoin(entity_ids)
+                for roon, entity_ids in group_by_server(service.data[ATTR_ENTITY_ID]).items()])
+
+    @asyncio.coroutine
+    def async_multi_command_service(service):
+        """Send a command to many players at once."""
+        yield from asyncio.gather(*[roon.async_multi_command(entity_ids, service.data[ATTR_COMMAND],
+                service.data.get(ATTR_VOLUME_LEVEL))
+                for roon, entity_ids in group_by_server(service.data[ATTR_ENTITY_ID]).items()])
+
+    hass.services.async_register(DOMAIN, SERVICE_PROFILE, async_profile_service, schema=PROFILE_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_JOIN, async_join_service, schema=JOIN_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_UNJOIN, async_unjoin_service, schema=UNJOIN_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_MULTI_COMMAND, async_multi_command_service,
+            schema=MULTI_COMMAND_SCHEMA)
     hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, stop_roon)
-    roon.start_roon()
+    for roon, _ in servers:
+        roon.start_roon()
+
+
+def _intern(value):
+    ''' intern strings, metadata like artist and album names repeats across zones and events'''
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class RoonZoneState(object):
+    """Compact state of a zone, one object is shared by all outputs of the zone."""
+
+    __slots__ = ("zone_id", "name", "state", "title", "artist", "album", "image_key", "length",
+                 "seek_position", "shuffle", "loop", "is_synced", "media")
+    # fields derived from the other ones, not persisted
+    DERIVED = ("media",)
+
+    def __init__(self, zone_id, name, state=None, title=None, artist=None, album=None, image_key=None,
+                 length=0, seek_position=0, shuffle=False, loop=False, is_synced=False):
+        """Initialize the zone state."""
+        self.zone_id = _intern(zone_id)
+        self.name = _intern(name)
+        self.state = _intern(state)
+        self.title = _intern(title)
+        self.artist = _intern(artist)
+        self.album = _intern(album)
+        self.image_key = _intern(image_key)
+        self.length = length
+        self.seek_position = seek_position
+        self.shuffle = shuffle
+        self.loop = _intern(loop)
+        self.is_synced = is_synced
+        # the media attributes of the zone, computed once for all outputs (see RoonDevice.update_attributes)
+        self.media = None
+
+    @classmethod
+    def from_zone(cls, zone):
+        ''' create from a zone as reported by roonapi'''
+        now_playing = zone.get("now_playing") or {}
+        three_line = now_playing.get("three_line") or {}
+        settings = zone.get("settings") or {}
+        # the top level seek_position is kept up to date by the seek events
+        seek_position = zone.get("seek_position", now_playing.get("seek_position"))
+        return cls(zone["zone_id"], zone["display_name"], zone.get("state"),
+                   three_line.get("line1"), three_line.get("line2"), three_line.get("line3"),
+                   now_playing.get("image_key"), now_playing.get("length") or 0, seek_position or 0,
+                   settings.get("shuffle", False), settings.get("loop", False), len(zone["outputs"]) > 1)
+
+    @classmethod
+    def from_dict(cls, data):
+        ''' create from the output of to_dict'''
+        return cls(**data)
+
+    def to_dict(self):
+        ''' all persistent fields as a (json serializable) dict'''
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot not in self.DERIVED}
+
+
+class RoonPlayerData(object):
+    """Compact record of an output, holds only the fields the entity exposes."""
+
+    __slots__ = ("dev_id", "output_id", "display_name", "zone", "volume_type", "volume_value", "volume_step",
+                 "is_muted", "standby_control", "can_group_with", "is_available", "last_changed")
+
+    def __init__(self, dev_id, output_id, display_name, zone, volume_type=None, volume_value=None,
+                 volume_step=None, is_muted=False, standby_control=None, can_group_with=(), is_available=True,
+                 last_changed=None):
+        """Initialize the player data."""
+        self.dev_id = _intern(dev_id)
+        self.output_id = _intern(output_id)
+        self.display_name = _intern(display_name)
+        self.zone = zone
+        self.volume_type = _intern(volume_type)
+        self.volume_value = volume_value
+        self.volume_step = volume_step
+        self.is_muted = is_muted
+        # (control_key, status) of the source control that supports standby, if any
+        self.standby_control = standby_control
+        self.can_group_with = can_group_with
+        self.is_available = is_available
+        self.last_changed = last_changed
+
+    @classmethod
+    def from_output(cls, dev_id, output, zone):
+        ''' create from an output as reported by roonapi and the state of its zone'''
+        volume = output.get("volume") or {}
+        standby_control = None
+        for source in output.get("source_controls") or []:
+            if source["supports_standby"] and source["status"] != "indeterminate":
+                standby_control = (_intern(source["control_key"]), _intern(source["status"]))
+                break
+        return cls(dev_id, output["output_id"], output["display_name"], zone,
+                   volume.get("type"), volume.get("value"), volume.get("step"), volume.get("is_muted", False),
+                   standby_control, tuple(_intern(output_id) for output_id in output.get("can_group_with_output_ids", ())))
+
+    @classmethod
+    def from_dict(cls, data):
+        ''' create from the output of to_dict'''
+        data = dict(data)
+        data["zone"] = RoonZoneState.from_dict(data["zone"])
+        if data["standby_control"]:
+            data["standby_control"] = tuple(data["standby_control"])
+        data["can_group_with"] = tuple(data["can_group_with"])
+        return cls(**data)
+
+    def to_dict(self):
+        ''' all fields except the timestamp as a (json serializable) dict'''
+        data = {slot: getattr(self, slot) for slot in self.__slots__ if slot != "last_changed"}
+        data["zone"] = self.zone.to_dict()
+        return data
+
+
+def _player_fingerprint(player_data):
+    ''' the fields of a player record compared by a resync, the seek position is updated on its own'''
+    data = player_data.to_dict()
+    zone = data.pop("zone")
+    zone.pop("seek_position")
+    return tuple(sorted(data.items())), tuple(sorted(zone.items()))
+
+
+# the values of the entity properties, computed once per update (see RoonDevice.update_attributes)
+RoonAttributes = collections.namedtuple("RoonAttributes", [
+    "available", "state", "name", "volume_level", "is_volume_muted", "volume_step", "media_title", "media_artist",
+    "media_album_name", "media_image_url", "media_duration", "shuffle", "repeat", "source", "source_list"])
 
 
 class RoonDevice(MediaPlayerDevice):
@@ -115,11 +440,14 @@ class RoonDevice(MediaPlayerDevice):
         self._server = server
         self._available = True
         self._last_position_update = None
+        self._media_position = 0
+        self._media_percent_played = 0
         self._supports_standby = False
         self._state = STATE_IDLE
         self._last_playlist = None
+        self._attributes = None
+        self.provisional = False
         self.update_data(player_data)
-        
 
     @property
     def hidden(self):
@@ -128,7 +456,7 @@ class RoonDevice(MediaPlayerDevice):
 
     def set_hidden(self, value):
         """Set hidden property."""
-        self._available = not value
+        self.set_available(not value)
 
     @property
     def available(self):
@@ -138,6 +466,8 @@ class RoonDevice(MediaPlayerDevice):
     def set_available(self, value):
         """Set available property."""
         self._available = value
+        self.update_state()
+        self.update_attributes()
 
     @property
     def supported_features(self):
@@ -150,41 +480,104 @@ class RoonDevice(MediaPlayerDevice):
         self.update_data(self.player_data)
 
     def update_data(self, player_data=None):
-        """ Update session object. """
+        """ Update session object, returns True if any of the fields exposed to hass changed. """
+        last_changed = self.player_data.last_changed if self._attributes else None
         if player_data:
             self.player_data = player_data
-        self._available = self.player_data["is_available"]
+        self._available = self.player_data.is_available
         self._sources = self.get_sync_zones()
         # determine player state
         self.update_state()
-        if self.state == STATE_PLAYING:
-            self._last_position_update = utcnow()
-        
+        prev_attributes = self._attributes
+        changed = self.update_attributes() != prev_attributes
+        if changed and self._server.artwork:
+            # new track: have the artwork in the cache before the frontend asks for it
+            self._server.artwork.prefetch(self.get_image_key())
+        # on a state or track change always take over the position, otherwise only when it deviates
+        if self.update_position(self.get_seek_position(), force=changed):
+            changed = True
+        if not changed:
+            # nothing changed that hass can see, keep the original timestamp
+            self.player_data.last_changed = last_changed
+        return changed
+
+    def update_position(self, seek_position, force=False):
+        '''
+            Update the media position, returns True if it changed.
+            Hass extrapolates the position while playing, so only a seek or a drift
+            beyond SEEK_TOLERANCE needs a new position and timestamp.
+        '''
+        now = utcnow()
+        seek_position = int(seek_position or 0)
+        if not force and self._last_position_update:
+            expected = self._media_position
+            if self._state == STATE_PLAYING:
+                expected += (now - self._last_position_update).total_seconds()
+            if abs(seek_position - expected) < SEEK_TOLERANCE:
+                return False
+        self._media_position = seek_position
+        self._last_position_update = now
+        duration = self._attributes.media_duration if self._attributes else 0
+        self._media_percent_played = seek_position / duration * 100 if duration else 0
+        return True
+
+    def get_seek_position(self):
+        ''' the seek position as reported by roon'''
+        return self.player_data.zone.seek_position
+
+    def get_snapshot(self):
+        ''' the player data to persist, see RoonServer.async_save_state'''
+        snapshot = self.player_data.to_dict()
+        # the availability of the entity, the player data of an output which went offline still says available
+        snapshot["is_available"] = self._available
+        snapshot["sources"] = self._sources
+        return snapshot
+
+    def update_attributes(self):
+        '''
+            Compute the values of the entity properties from the player data.
+            The properties only return these values, so a state write does no further work and
+            comparing with the previous snapshot tells if a state write is needed at all.
+        '''
+        player_data = self.player_data
+        zone = player_data.zone
+        volume_level = 0
+        if player_data.volume_value is not None:
+            if player_data.volume_type == "db":
+                volume_level = (int(float(player_data.volume_value / 80) * 100) + 100) / 100
+            else:
+                volume_level = int(player_data.volume_value) / 100
+        if zone.media is None:
+            # first output of the zone in this update, the other outputs share the result
+            image_url = self._server.get_image_url(zone.image_key) if zone.image_key else None
+            zone.media = (zone.title, zone.artist, zone.album, image_url, int(zone.length or 0),
+                          zone.shuffle, zone.loop, zone.name)
+        self._attributes = RoonAttributes(
+            self._available, self._state, player_data.display_name or DEVICE_DEFAULT_NAME, volume_level,
+            player_data.is_muted, int(player_data.volume_step or 0), *zone.media, tuple(self._sources))
+        return self._attributes
+
     def update_state(self):
         ''' update the power state and player state '''
         if not self.available:
             self._state = STATE_OFF
         else:
-            cur_state = self._state
             new_state = ""
             # power state from source control (if supported)
-            if 'source_controls' in self.player_data:
-                for source in self.player_data["source_controls"]:
-                    if source["supports_standby"]:
-                        if not source["status"] == "indeterminate":
-                            self._supports_standby = True
-                            if source["status"] in ["standby", "deselected"]:
-                                new_state = STATE_OFF
-                            break
+            if self.player_data.standby_control:
+                self._supports_standby = True
+                if self.player_data.standby_control[1] in ["standby", "deselected"]:
+                    new_state = STATE_OFF
             # determine player state
             if not new_state:
-                if self.player_data['state'] == 'playing':
+                zone_state = self.player_data.zone.state
+                if zone_state == 'playing':
                     new_state = STATE_PLAYING
-                elif self.player_data['state'] == 'loading':
+                elif zone_state == 'loading':
                     new_state = STATE_PLAYING
-                elif self.player_data['state'] == 'stopped':
+                elif zone_state == 'stopped':
                     new_state = STATE_IDLE
-                elif self.player_data['state'] == 'paused':
+                elif zone_state == 'paused':
                     new_state = STATE_PAUSED
                 else:
                     new_state = STATE_IDLE
@@ -193,23 +586,45 @@ class RoonDevice(MediaPlayerDevice):
     @asyncio.coroutine
     def async_added_to_hass(self):
         """Register callback."""
-        _LOGGER.info("New Roon Device %s initialized with ID: %s" % (self.entity_id, self.unique_id))
+        _LOGGER.info("New Roon Device %s initialized with ID: %s", self.entity_id, self.unique_id)
+        self._server.register_entity(self.entity_id, self.unique_id)
         self._server.add_update_callback(
             self.async_update_callback, self.unique_id)
 
+    @asyncio.coroutine
+    def async_will_remove_from_hass(self):
+        """Entity is removed from hass."""
+        self._server.remove_update_callback(self.async_update_callback, self.unique_id)
+        self._server.unregister_entity(self.entity_id, self.unique_id)
+
     @callback
     def async_update_callback(self, msg):
         """Handle device updates."""
+        self._server.metrics.increment("state_writes")
         self.async_schedule_update_ha_state()
 
+    def update_sources(self):
+        ''' refresh the source list after the zones changed, returns True if it changed'''
+        sources = self.get_sync_zones()
+        if sources == self._sources:
+            return False
+        self._sources = sources
+        self.update_attributes()
+        return True
+
+    def set_sources(self, sources):
+        ''' set the source list, used for players restored from the previous run'''
+        if sources:
+            self._sources = sources
+            self.update_attributes()
+
     def get_sync_zones(self):
         ''' get available sync slaves'''
-        sync_zones = [self.name]
-        for zone in self._server.zones.values():
-            for output in zone["outputs"]:
-                if output["output_id"] in self.player_data["can_group_with_output_ids"] and zone['display_name'] not in sync_zones:
-                    sync_zones.append( zone["display_name"] )
-        _LOGGER.debug("sync_slaves for player %s: %s" % (self.name, sync_zones))
+        sync_zones = [self.player_data.display_name]
+        for zone_name in self._server.get_sync_zones(self.player_data.can_group_with):
+            if zone_name not in sync_zones:
+                sync_zones.append(zone_name)
+        _LOGGER.debug("sync_slaves for player %s: %s", sync_zones[0], sync_zones)
         return sync_zones
 
     @property
@@ -223,12 +638,12 @@ class RoonDevice(MediaPlayerDevice):
     @property
     def last_changed(self):
         ''' when was the object last updated on the server'''
-        return self.player_data["last_changed"]
+        return self.player_data.last_changed
 
     @property
     def unique_id(self):
         """Return the id of this roon client."""
-        return self.player_data['dev_id']
+        return self.player_data.dev_id
 
     @property
     def should_poll(self):
@@ -238,50 +653,32 @@ class RoonDevice(MediaPlayerDevice):
     @property
     def zone_id(self):
         """ Return current session Id. """
-        try:
-            return self.player_data['zone_id']
-        except KeyError:
-            return None
+        return self.player_data.zone.zone_id
 
     @property
     def output_id(self):
         """ Return current session Id. """
-        try:
-            return self.player_data['output_id']
-        except KeyError:
-            return None
+        return self.player_data.output_id
 
     @property
     def name(self):
         """ Return device name."""
-        try:
-            return self.player_data['display_name']
-        except KeyError:
-            return DEVICE_DEFAULT_NAME
+        return self._attributes.name
 
     @property
     def media_title(self):
         """ Return title currently playing."""
-        try:
-            return self.player_data['now_playing']['three_line']['line1']
-        except KeyError:
-            return None
+        return self._attributes.media_title
 
     @property
     def media_album_name(self):
         """Album name of current playing media (Music track only)."""
-        try:
-            return self.player_data['now_playing']['three_line']['line3']
-        except KeyError:
-            return None
+        return self._attributes.media_album_name
 
     @property
     def media_artist(self):
         """Artist of current playing media (Music track only)."""
-        try:
-            return self.player_data['now_playing']['three_line']['line2']
-        except KeyError:
-            return None
+        return self._attributes.media_artist
 
     @property
     def media_album_artist(self):
@@ -296,64 +693,51 @@ class RoonDevice(MediaPlayerDevice):
     @property
     def media_image_url(self):
         """Image url of current playing media."""
-        try:
-            image_id = self.player_data['now_playing']['image_key']
-            url = self._server.roonapi.get_image(image_id)
-            return url
-        except KeyError:
-            return None
+        return self._attributes.media_image_url
+
+    def get_image_key(self):
+        ''' image key of the current playing media'''
+        return self.player_data.zone.image_key
+
+    @asyncio.coroutine
+    def async_get_media_image(self):
+        """Fetch the image of the current playing media, from the local artwork cache if enabled."""
+        image_key = self.get_image_key()
+        if not image_key or not self._server.artwork:
+            result = yield from super().async_get_media_image()
+            return result
+        result = yield from self._server.artwork.async_get(image_key)
+        return result
 
     @property
     def media_position(self):
         """ Return position currently playing."""
-        try:
-            return int(self.player_data['now_playing']['seek_position'])
-        except (KeyError, TypeError):
-            return 0
+        return self._media_position
 
     @property
     def media_duration(self):
         """ Return total runtime length."""
-        try:
-            return int(
-                self.player_data['now_playing']['length'])
-        except (KeyError, TypeError):
-            return 0
+        return self._attributes.media_duration
 
     @property
     def media_percent_played(self):
         """ Return media percent played. """
-        try:
-            return (self.media_position / self.media_runtime) * 100
-        except (KeyError, TypeError):
-            return 0
+        return self._media_percent_played
 
     @property
     def volume_level(self):
         """ Return current volume level"""
-        try:
-            if self.player_data["volume"]["type"] == "db":
-                return (int(float(self.player_data['volume']['value'] / 80) * 100) + 100) / 100
-            return int(self.player_data['volume']['value']) / 100
-        except (KeyError, TypeError):
-            return 0
+        return self._attributes.volume_level
 
     @property
     def is_volume_muted(self):
         """ Return mute state """
-        try:
-            return self.player_data['volume']['is_muted']
-        except (KeyError, TypeError):
-            return False
+        return self._attributes.is_volume_muted
 
     @property
     def volume_step(self):
         """ Return volume step size"""
-        try:
-            return int(
-                self.player_data['volume']['step'])
-        except (KeyError, TypeError):
-            return 0
+        return self._attributes.volume_step
 
     @property
     def supports_standby(self):
@@ -373,7 +757,7 @@ class RoonDevice(MediaPlayerDevice):
     @property
     def source(self):
         """Name of the current input source."""
-        return self.player_data['zone_name']
+        return self._attributes.source
 
     @property
     def source_list(self):
@@ -383,106 +767,160 @@ class RoonDevice(MediaPlayerDevice):
     @property
     def shuffle(self):
         """Boolean if shuffle is enabled."""
-        try:
-            return self.player_data['settings']['shuffle']
-        except (KeyError, TypeError):
-            return False
+        return self._attributes.shuffle
 
     @property
     def repeat(self):
         """Boolean if repeat is enabled."""
-        try:
-            return self.player_data['settings']['loop']
-        except (KeyError, TypeError):
-            return False
+        return self._attributes.repeat
+
+    def send_command(self, method, *args, **kwargs):
+        ''' queue a roonapi command, commands for the same zone are executed in order'''
+        return self._server.dispatcher.submit(self.zone_id or self.output_id, method, *args, **kwargs)
+
+    def _playlist_started(self, job):
+        ''' remember the playlist when roon accepted the play request'''
+        if not job.exception() and job.result():
+            self._last_playlist = job.result()
+
+    def _play_title(self, method, media_type, title, **kwargs):
+        '''
+            Play a playlist or station by its title, returns the title roon accepted (runs in the dispatcher).
+            Roon looks for the exact title first, only if it has none the single close match in the index is tried.
+        '''
+        play = getattr(self._server.roonapi, method)
+        if play(self.zone_id, title, **kwargs):
+            return title
+        match = self._server.library.resolve_title(media_type, title)
+        if not match or match == title:
+            return None
+        _LOGGER.debug("Roon has no %s named %s, playing %s", media_type, title, match)
+        return match if play(self.zone_id, match, **kwargs) else None
 
     def media_play(self):
         """ Send play command to device. """
-        self._server.roonapi.playback_control(self.output_id, "play")
+        self.send_command("playback_control", self.output_id, "play")
 
     def media_pause(self):
         """ Send pause command to device. """
-        self._server.roonapi.playback_control(self.output_id, "pause")
+        self.send_command("playback_control", self.output_id, "pause")
 
     def media_play_pause(self):
         """ toggle play command to device. """
-        self._server.roonapi.playback_control(self.output_id, "playpause")
+        self.send_command("playback_control", self.output_id, "playpause")
 
     def media_stop(self):
         """ Send stop command to device. """
-        self._server.roonapi.playback_control(self.output_id, "stop")
+        self.send_command("playback_control", self.output_id, "stop")
 
     def media_next_track(self):
         """ Send next track command to device. """
-        self._server.roonapi.playback_control(self.output_id, "next")
+        self.send_command("playback_control", self.output_id, "next")
 
     def media_previous_track(self):
         """ Send previous track command to device. """
-        self._server.roonapi.playback_control(self.output_id, "previous")
+        self.send_command("playback_control", self.output_id, "previous")
 
     def media_seek(self, position):
         """ Send seek command to device. """
-        self._server.roonapi.seek(self.output_id, position)
+        self.send_command("seek", self.output_id, position)
 
     def set_volume_level(self, volume):
         """ Send new volume_level to device. """
         volume = int(volume * 100)
-        try:
-            self._server.roonapi.change_volume(self.output_id, volume)
-        except Exception as exc:
-            _LOGGER.error("set_volume_level failed for entity %s \n %s" %(self.entity_id, str(exc)))
+        # only the latest value is sent while the user is dragging a slider
+        self._server.volume_sync.set_volume(self.output_id, volume, self._change_volume,
+                queue_key=self.zone_id or self.output_id)
+
+    def _change_volume(self, volume):
+        ''' send the (coalesced) volume level to roon, runs in the dispatcher'''
+        self._server.roonapi.change_volume(self.output_id, volume)
 
     def mute_volume(self, mute=True):
         """ Send mute/unmute to device. """
-        self._server.roonapi.mute(self.output_id, mute)
+        self.send_command("mute", self.output_id, mute)
 
     def volume_up(self):
         """ Send new volume_level to device. """
-        self._server.roonapi.change_volume(self.output_id, 3, "relative")
+        self.send_command("change_volume", self.output_id, 3, "relative")
 
     def volume_down(self):
         """ Send new volume_level to device. """
-        self._server.roonapi.change_volume(self.output_id, -3, "relative")
+        self.send_command("change_volume", self.output_id, -3, "relative")
 
     def turn_on(self):
         """ Turn on device (if supported) """
-        if self.supports_standby and 'source_controls' in self.player_data:
-            for source in self.player_data["source_controls"]:
-                if source["supports_standby"] and source["status"] != "indeterminate":
-                    self._server.roonapi.convenience_switch(self.output_id, source["control_key"])
-                    break
+        if self.supports_standby and self.player_data.standby_control:
+            self.send_command("convenience_switch", self.output_id, self.player_data.standby_control[0])
         else:
             return self.media_play()
 
     def turn_off(self):
         """ Turn off device (if supported) """
-        if self.supports_standby and 'source_controls' in self.player_data:
-            for source in self.player_data["source_controls"]:
-                if source["supports_standby"] and not source["status"] == "indeterminate":
-                    self._server.roonapi.standby(self.output_id, source["control_key"])
-                    break
+        if self.supports_standby and self.player_data.standby_control:
+            self.send_command("standby", self.output_id, self.player_data.standby_control[0])
         else:
             return self.media_stop()
 
     def set_shuffle(self, shuffle):
         """ Set shuffle state on zone """
-        self._server.roonapi.shuffle(self.output_id, shuffle)
+        self.send_command("shuffle", self.output_id, shuffle)
 
     def select_source(self, source):
         '''select source on player (used to sync/unsync)'''
-        _LOGGER.info("select source called - unsync %s" %(self.name))
+        _LOGGER.info("select source called - unsync %s", self.name)
         if source == self.name:
-            self._server.roonapi.ungroup_outputs([self.output_id])
+            self.send_command("ungroup_outputs", [self.output_id])
         else:
-            _LOGGER.info("select source called - sync %s with %s" %(self.name, source))
-            output_ids = []
-            for zone_id, zone in self._server.zones.items():
-                if zone["display_name"].lower() == source.lower():
-                    for output in zone["outputs"]:
-                        output_ids.append(output["output_id"])
-                    output_ids.append(self.output_id)
-                    self._server.roonapi.group_outputs(output_ids)
-                    break
+            _LOGGER.info("select source called - sync %s with %s", self.name, source)
+            zone_id = self._server.get_zone_id(source)
+            if zone_id:
+                output_ids = list(self._server.get_zone_outputs(zone_id))
+                output_ids.append(self.output_id)
+                self.send_command("group_outputs", output_ids)
+
+    @asyncio.coroutine
+    def async_browse_media(self, media_content_type=None, media_content_id=None):
+        """Browse the Roon library, one page of a list at a time."""
+        item_key, offset = None, 0
+        if media_content_id and media_content_id != BROWSE_ROOT:
+            item_key, _, offset = media_content_id.partition(BROWSE_PAGE_SEPARATOR)
+            offset = int(offset or 0)
+            if item_key == BROWSE_ROOT:
+                item_key = None
+        page = yield from self._server.browser.async_browse(item_key, offset)
+        if page is None:
+            raise BrowseError("Roon item %s not found" % media_content_id)
+        return self._browse_media(page)
+
+    def _browse_media(self, page):
+        ''' the BrowseMedia of a page, with a link to the next page if the list is longer'''
+        children = []
+        for item in page.items:
+            if item.hint == "header":
+                continue
+            thumbnail = self._server.get_image_url(item.image_key) if item.image_key else None
+            children.append(BrowseMedia(
+                    media_class=MEDIA_CLASS_DIRECTORY if item.hint == "list" else MEDIA_CLASS_MUSIC,
+                    media_content_id=item.item_key, media_content_type=MEDIA_TYPE_LIBRARY, title=item.title,
+                    can_play=item.hint in ("action_list", "action"), can_expand=item.hint == "list",
+                    thumbnail=thumbnail))
+        item_key = page.item_key or BROWSE_ROOT
+        title = page.title or "Roon"
+        next_offset = page.offset + BROWSE_PAGE_SIZE
+        if next_offset < page.count:
+            children.append(BrowseMedia(
+                    media_class=MEDIA_CLASS_DIRECTORY,
+                    media_content_id="%s%s%s" % (item_key, BROWSE_PAGE_SEPARATOR, next_offset),
+                    media_content_type=MEDIA_TYPE_LIBRARY,
+                    title="%s %s-%s of %s" % (title, next_offset + 1,
+                            min(next_offset + BROWSE_PAGE_SIZE, page.count), page.count),
+                    can_play=False, can_expand=True))
+        if page.offset:
+            item_key = "%s%s%s" % (item_key, BROWSE_PAGE_SEPARATOR, page.offset)
+        return BrowseMedia(media_class=MEDIA_CLASS_DIRECTORY, media_content_id=item_key,
+                media_content_type=MEDIA_TYPE_LIBRARY, title=title, can_play=False, can_expand=True,
+                children=children, children_media_class=MEDIA_CLASS_DIRECTORY)
 
     def play_media(self, media_type, media_id, **kwargs):
         """
@@ -490,23 +928,30 @@ class RoonDevice(MediaPlayerDevice):
             Roon itself doesn't support playback of media by filename/url so this a bit of a workaround.
         """
         media_type = media_type.lower()
+        # playlists and stations are played by their exact title, (slightly) misspelled ones are resolved if that fails
         if media_type == "radio":
-            if self._server.roonapi.play_radio(self.zone_id, media_id):
-                self._last_playlist = media_id
-                self._last_media = media_id
+            self.send_command(self._play_title, "play_radio", "radio", media_id).add_done_callback(
+                    self._playlist_started)
         elif media_type == "playlist":
-            if self._server.roonapi.play_playlist(self.zone_id, media_id, shuffle=False):
-                self._last_playlist = media_id
+            self.send_command(self._play_title, "play_playlist", "playlist", media_id,
+                    shuffle=False).add_done_callback(self._playlist_started)
         elif media_type == "shuffleplaylist":
-            if self._server.roonapi.play_playlist(self.zone_id, media_id, shuffle=True):
-                self._last_playlist = media_id
+            self.send_command(self._play_title, "play_playlist", "playlist", media_id,
+                    shuffle=True).add_done_callback(self._playlist_started)
         elif media_type == "queueplaylist":
-            self._server.roonapi.queue_playlist(self.zone_id, media_id)
+            self.send_command(self._play_title, "queue_playlist", "playlist", media_id)
         elif media_type == "genre":
-            self._server.roonapi.play_genre(self.zone_id, media_id)
+            self.send_command("play_genre", self.zone_id, media_id)
+        elif media_type == MEDIA_TYPE_LIBRARY:
+            # an item picked in the media browser, media_id is its item key
+            self.send_command(self._server.browser.play, self.zone_id, media_id)
+        elif media_type in SEARCH_CATEGORIES:
+            # the index gives the exact title (and artist) to look for in the search results
+            title, subtitle = self._server.library.resolve(media_type, media_id) or (media_id, None)
+            self.send_command(self._server.library.play, self.zone_id, media_type, title, subtitle)
         elif self._server.custom_play_action:
             # reroute the play request to the given custom script
-            _LOGGER.debug("Playback requested. Will forward to custom script/action: %s" % self._server.custom_play_action)
+            _LOGGER.debug("Playback requested. Will forward to custom script/action: %s", self._server.custom_play_action)
             data = {
                 "entity_id": self.entity_id,
                 "media_type": media_type,
@@ -515,34 +960,93 @@ class RoonDevice(MediaPlayerDevice):
             _domain, _entity = self._server.custom_play_action.split(".")
             self.hass.services.call(_domain, _entity, data, blocking=False)
         else:
-            _LOGGER.info("Playback requested of unsupported type: %s --> %s" %(media_type, media_id))
+            _LOGGER.info("Playback requested of unsupported type: %s --> %s", media_type, media_id)
 
 
 class RoonServer(object):
     """Roon Server class - holds the connection to Roon websockets api."""
 
-    def __init__(self, hass, roonapi, add_devices_callback, custom_play_action, source_controls, volume_controls):
-        """Initialize base class."""
+    def __init__(self, hass, roonapi, add_devices_callback, custom_play_action, source_controls, volume_controls,
+            update_window=UPDATE_WINDOW, artwork_cache_size=0, trace_file=None, state_file=None,
+            library_file=None, namespace=None, host=None, profiler=None, connect=None):
+        """
+            Initialize base class, the namespace keeps the players of additional cores apart.
+            connect(token) creates a new RoonApi, the watchdog uses it to reconnect.
+        """
         self.hass = hass
         self.roonapi = roonapi
+        self.namespace = namespace
+        self.host = host
+        suffix = "_%s" % namespace if namespace else ""
         self._devices = {}
+        self._update_window = update_window
+        self._pending_zones = set()
+        self._pending_seeks = set()
+        self._pending_outputs = set()
+        self._pending_lock = threading.Lock()
+        self._pending_since = 0
+        self._ingest_scheduled = False
+        self._loop_lag = 0
+        self._last_lag_probe = 0
+        self._last_pass_duration = 0
+        self._output_zones = {}
+        self._zone_outputs = {}
+        self._zone_names = {}
+        self._zone_ids_by_name = {}
+        self._devices_by_name = {}
+        self._devices_by_entity = {}
+        self._devices_by_output = {}
+        self._sync_zones_cache = {}
+        self.skipped_updates = 0
+        self.catalog = RoonCatalog(hass, roonapi)
+        # playback of artists, albums and tracks, the index is only built when a library file is given
+        self.library = RoonLibrary(hass, roonapi, library_file)
+        self._playlists_fingerprint = None
+        self.metrics = RoonMetrics()
+        # the media browser, the cached pages are shared by all players
+        self.browser = RoonBrowser(hass, roonapi, self.metrics)
+        self.profiler = profiler or RoonProfiler(hass)
+        self._diagnostics_entity = DIAGNOSTICS_ENTITY + suffix
+        self._remove_diagnostics_listener = None
+        self._last_event = None
+        self._connect = connect
+        self._exit = False
+        self._reconnecting = False
+        self._probe_failures = 0
+        self._remove_watchdog_listener = None
+        self.dispatcher = RoonCommandDispatcher(self)
+        self.volume_sync = RoonVolumeSync(self.dispatcher)
+        # keys of the volume changes with a check scheduled for when they settled
+        self._settle_checks = set()
+        self._image_urls = collections.OrderedDict()
+        self.artwork = None
+        if artwork_cache_size:
+            self.artwork = RoonArtworkCache(hass, self, hass.config.path(ARTWORK_DIR + suffix), artwork_cache_size)
+        self._recorder = RoonTraceRecorder(trace_file) if trace_file else None
+        self._state_file = state_file
         self._last_change = None
         self._add_devices_callback = add_devices_callback
-        self._update_callbacks = []
+        # dev_id: [weak reference to callback], entities which are gone don't leave their callbacks behind
+        self._update_callbacks = {}
+        self._pending_callbacks = collections.OrderedDict()
         self._init_playlists_done = False
         self._initial_playlist = None
         self._initial_player = None
         self.all_player_names = []
         self.all_playlists = []
         self.all_player_entities = []
-        self.offline_devices = []
+        self.offline_devices = set()
         self._selected_player = ""
         self.custom_play_action = custom_play_action
-        self.source_controls = source_controls
-        self.volume_controls = volume_controls
-        self.registed_source_controls = []
-        self.registered_volume_controls = []
-        self.roonapi.register_state_callback(self.roonapi_state_callback, event_filter=["zones_changed"])
+        self.source_controls = set(source_controls or ())
+        self.volume_controls = set(volume_controls or ())
+        self.registered_source_controls = set()
+        self.registered_volume_controls = set()
+        # entity id: the last status/volume sent to roon, unchanged values are not sent again
+        self._source_control_states = {}
+        self._volume_control_states = {}
+        self.roonapi.register_state_callback(self.roonapi_state_callback,
+                event_filter=["zones_changed", "zones_seek_changed", "outputs_changed"])
 
 
     @property
@@ -556,98 +1060,500 @@ class RoonServer(object):
     def start_roon(self):
         '''Initialize Roon background polling'''
         ensure_future(self.do_loop())
+        self._remove_diagnostics_listener = event.async_track_time_interval(
+                self.hass, self.publish_diagnostics, timedelta(seconds=DIAGNOSTICS_INTERVAL))
+        if self._connect:
+            self._remove_watchdog_listener = event.async_track_time_interval(
+                    self.hass, self.async_watchdog, timedelta(seconds=WATCHDOG_INTERVAL))
         
     def stop_roon(self):
         '''Stop background worker'''
         self._exit = True
+        if self._remove_diagnostics_listener:
+            self._remove_diagnostics_listener()
+        if self._remove_watchdog_listener:
+            self._remove_watchdog_listener()
+        self.dispatcher.shutdown()
+        if self._recorder:
+            self._recorder.close()
 
     def roonapi_state_callback(self, event, changed_zones):
         '''callbacks from the roon api websockets'''
-        asyncio.run_coroutine_threadsafe(self.update_changed_players(changed_zones), self.hass.loop)
+        if self.profiler.active:
+            self.profiler.runcall(self._handle_state_callback, event, changed_zones)
+        else:
+            self._handle_state_callback(event, changed_zones)
+
+    def _handle_state_callback(self, event, changed_zones):
+        ''' ingest a state event (runs in the roonapi thread)'''
+        self.metrics.increment("events_received")
+        self._last_event = time.monotonic()
+        if self._recorder:
+            self._recorder.record(event, changed_zones, self.roonapi.zones, self.roonapi.outputs)
+        # merge the changed zones into the pending set, only the first event of a burst wakes up the loop
+        with self._pending_lock:
+            if event == "zones_seek_changed":
+                self._pending_seeks.update(changed_zones)
+            elif event == "outputs_changed":
+                self._pending_outputs.update(changed_zones)
+            else:
+                self._pending_zones.update(changed_zones)
+            if self._ingest_scheduled:
+                now = time.monotonic()
+                if now - self._last_lag_probe < 1:
+                    return
+                # while the ingest is running, measure the loop lag at most once per second
+                self._last_lag_probe = now
+                self.hass.loop.call_soon_threadsafe(self._measure_loop_lag, now)
+                return
+            self._ingest_scheduled = True
+            self._pending_since = time.monotonic()
+        self.hass.loop.call_soon_threadsafe(self._start_ingest)
+
+    @callback
+    def _start_ingest(self):
+        ''' start draining the pending zone changes (runs in the event loop)'''
+        self._measure_loop_lag(self._pending_since)
+        ensure_future(self._drain_pending_zones(), loop=self.hass.loop)
+
+    @callback
+    def _measure_loop_lag(self, scheduled):
+        ''' the time it took the loop to run a callback scheduled from the roonapi thread'''
+        self._loop_lag = time.monotonic() - scheduled
+        self.metrics.observe("loop_lag", self._loop_lag)
+
+    @asyncio.coroutine
+    def _drain_pending_zones(self):
+        ''' process the pending zone changes, one update pass per window'''
+        while True:
+            # backpressure: if the loop is lagging or the last pass was slow, wait longer so more events collapse
+            window = min(max(self._update_window, self._loop_lag, self._last_pass_duration), MAX_UPDATE_WINDOW)
+            if window:
+                yield from asyncio.sleep(window, self.hass.loop)
+            with self._pending_lock:
+                changed_zones = self._pending_zones
+                # zones with a full update get their position from that update
+                seek_zones = self._pending_seeks - changed_zones
+                changed_outputs = self._pending_outputs
+                self._pending_zones = set()
+                self._pending_seeks = set()
+                self._pending_outputs = set()
+                if not changed_zones and not seek_zones and not changed_outputs:
+                    self._ingest_scheduled = False
+                    return
+            start = time.monotonic()
+            try:
+                if changed_zones:
+                    yield from self.update_changed_players(changed_zones)
+                if seek_zones:
+                    self.update_seek_positions(seek_zones)
+                if changed_outputs:
+                    self.update_removed_outputs(changed_outputs)
+                yield from self.update_removed()
+            except Exception:
+                _LOGGER.exception("Error while processing changed zones")
+            self._last_pass_duration = time.monotonic() - start
+            self.metrics.observe("update_pass", self._last_pass_duration)
 
     def roon_source_control_callback(self, control_key, new_state):
+        ''' roon switched a source control (runs in the roonapi thread), handled in the event loop'''
+        self.hass.loop.call_soon_threadsafe(self._handle_source_control, control_key, new_state)
+
+    @callback
+    def _handle_source_control(self, control_key, new_state):
+        ''' switch the hass entity of a source control'''
         entity_obj = self.hass.states.get(control_key)
+        if not entity_obj:
+            return
         if "media_player" in control_key and "roon" in entity_obj.attributes.get("source_list", []):
             if new_state == "standby" and entity_obj.attributes.get("source", "") == "roon":
-                self.hass.services.call('media_player', "turn_off", {"entity_id": control_key})
+                self._call_service('media_player', "turn_off", {"entity_id": control_key})
             elif new_state == "convenience_switch":
-                self.hass.services.call('media_player', "select_source", {"entity_id": control_key, "source": "roon"})
+                self._call_service('media_player', "select_source", {"entity_id": control_key, "source": "roon"})
         else:
             # just use on/off control
             svc = "turn_off" if new_state == "standby" else "turn_on"
-            self.hass.services.call('homeassistant', svc, {"entity_id": control_key})
+            self._call_service('homeassistant', svc, {"entity_id": control_key})
 
     def roon_volume_control_callback(self, control_key, event, data):
+        ''' roon changed a volume control (runs in the roonapi thread)'''
         if event == "set_mute":
-            self.hass.services.call('media_player', "volume_mute", {"entity_id": control_key, "is_volume_muted": data})
+            self.hass.loop.call_soon_threadsafe(self._call_service, 'media_player', "volume_mute",
+                    {"entity_id": control_key, "is_volume_muted": data})
         elif event == "set_volume":
             hass_vol = data/100
-            self.hass.services.call('media_player', "volume_set", {"entity_id": control_key, "volume_level": hass_vol})
+            self.volume_sync.set_volume(control_key, hass_vol, functools.partial(self._set_hass_volume, control_key))
+
+    def _set_hass_volume(self, entity_id, volume_level):
+        ''' set the volume of a hass volume control, runs in the dispatcher'''
+        self.hass.loop.call_soon_threadsafe(self._call_service, 'media_player', "volume_set",
+                {"entity_id": entity_id, "volume_level": volume_level})
+
+    @callback
+    def _call_service(self, domain, service, data):
+        ''' call a hass service without waiting for it to complete'''
+        ensure_future(self.hass.services.async_call(domain, service, data), loop=self.hass.loop)
+
+    def get_image_url(self, image_key):
+        ''' image url for the given image key, memoized'''
+        url = self._image_urls.get(image_key)
+        if url is None:
+            url = self._image_urls[image_key] = self.roonapi.get_image(image_key)
+            if len(self._image_urls) > IMAGE_URL_CACHE_SIZE:
+                self._image_urls.popitem(last=False)
+        return url
+
+    def update_zone_index(self, zone_id, zone):
+        ''' refresh the output/zone index, only when the zone membership or name changed'''
+        output_ids = tuple(output["output_id"] for output in zone["outputs"])
+        zone_name = zone["display_name"]
+        if self._zone_outputs.get(zone_id) == output_ids and self._zone_names.get(zone_id) == zone_name:
+            return False
+        self.remove_zone_index(zone_id)
+        for output_id in output_ids:
+            self._output_zones[output_id] = zone_id
+        self._zone_outputs[zone_id] = output_ids
+        self._zone_names[zone_id] = zone_name
+        self._zone_ids_by_name[zone_name.lower()] = zone_id
+        return True
+
+    def remove_zone_index(self, zone_id):
+        ''' remove a zone from the output/zone index'''
+        for output_id in self._zone_outputs.pop(zone_id, ()):
+            # the output may already be moved to another zone
+            if self._output_zones.get(output_id) == zone_id:
+                del self._output_zones[output_id]
+        zone_name = self._zone_names.pop(zone_id, None)
+        if zone_name and self._zone_ids_by_name.get(zone_name.lower()) == zone_id:
+            del self._zone_ids_by_name[zone_name.lower()]
+        self._sync_zones_cache.clear()
+
+    def get_zone_outputs(self, zone_id):
+        ''' return the output ids of the given zone'''
+        return self._zone_outputs.get(zone_id, ())
+
+    def get_zone_id(self, zone_name):
+        ''' return the zone id for the given zone name (case insensitive)'''
+        return self._zone_ids_by_name.get(zone_name.lower())
+
+    def get_device_by_name(self, name):
+        ''' return the device with the given name'''
+        dev_id = self._devices_by_name.get(name)
+        return self._devices.get(dev_id) if dev_id else None
+
+    def get_device_by_entity(self, entity_id):
+        ''' return the device for the given entity id'''
+        dev_id = self._devices_by_entity.get(entity_id)
+        return self._devices.get(dev_id) if dev_id else None
+
+    def register_entity(self, entity_id, dev_id):
+        ''' add the entity id of a device to the index, called when it is added to hass'''
+        self._devices_by_entity[entity_id] = dev_id
+
+    def unregister_entity(self, entity_id, dev_id):
+        '''
+            Remove the entity id of a device from the index, called when it is removed from hass.
+            The device itself is kept, it is still a roon output and hass can add its entity again.
+        '''
+        if self._devices_by_entity.get(entity_id) == dev_id:
+            del self._devices_by_entity[entity_id]
+
+    def resolve_entities(self, entity_ids):
+        ''' return the devices of the given entity ids, unknown entities are logged and skipped'''
+        devices = []
+        for entity_id in entity_ids:
+            dev = self.get_device_by_entity(entity_id)
+            if dev:
+                devices.append(dev)
+            else:
+                _LOGGER.warning("%s is not a Roon player", entity_id)
+        return devices
+
+    @asyncio.coroutine
+    def async_join(self, master_entity_id, entity_ids):
+        ''' group the outputs of the given players with the zone of the master, in one request'''
+        master = self.get_device_by_entity(master_entity_id)
+        if not master:
+            _LOGGER.warning("%s is not a Roon player", master_entity_id)
+            return False
+        output_ids = list(self.get_zone_outputs(master.zone_id)) or [master.output_id]
+        for dev in self.resolve_entities(entity_ids):
+            if dev.output_id not in output_ids:
+                output_ids.append(dev.output_id)
+        try:
+            yield from asyncio.wrap_future(self.dispatcher.submit(master.zone_id, "group_outputs", output_ids),
+                    loop=self.hass.loop)
+        except Exception:
+            # already logged by the dispatcher
+            return False
+        return True
+
+    @asyncio.coroutine
+    def async_unjoin(self, entity_ids):
+        ''' ungroup the outputs of the given players, in one request'''
+        output_ids = [dev.output_id for dev in self.resolve_entities(entity_ids)]
+        if not output_ids:
+            return False
+        # queue behind the other commands for the zone, like the player commands
+        zone_id = self._output_zones.get(output_ids[0], output_ids[0])
+        try:
+            yield from asyncio.wrap_future(self.dispatcher.submit(zone_id, "ungroup_outputs", output_ids),
+                    loop=self.hass.loop)
+        except Exception:
+            return False
+        return True
+
+    @asyncio.coroutine
+    def async_multi_command(self, entity_ids, command, volume_level=None):
+        '''
+            Send a command to many players. Commands for different zones run in parallel,
+            the results are logged and fired as EVENT_MULTI_COMMAND_RESULT.
+        '''
+        jobs = {}
+        zones_done = set()
+        for dev in self.resolve_entities(entity_ids):
+            if command in ZONE_COMMANDS:
+                if dev.zone_id in zones_done:
+                    # playback applies to the whole zone, one command per zone is enough
+                    continue
+                zones_done.add(dev.zone_id)
+            method, args = self.get_multi_command(dev, command, volume_level)
+            jobs[dev.entity_id] = asyncio.wrap_future(dev.send_command(method, *args), loop=self.hass.loop)
+        succeeded = []
+        failed = {}
+        if jobs:
+            results = yield from asyncio.gather(*jobs.values(), return_exceptions=True)
+            for entity_id, result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    failed[entity_id] = str(result)
+                else:
+                    succeeded.append(entity_id)
+        if failed:
+            _LOGGER.warning("Roon command %s failed for %s", command, ", ".join(sorted(failed)))
+        _LOGGER.debug("Roon command %s sent to %s", command, succeeded)
+        self.hass.bus.async_fire(EVENT_MULTI_COMMAND_RESULT,
+                {ATTR_COMMAND: command, "succeeded": succeeded, "failed": failed})
+        return not failed
+
+    @staticmethod
+    def get_multi_command(dev, command, volume_level=None):
+        ''' the roonapi method and arguments for a multi_command command'''
+        standby_control = dev.player_data.standby_control
+        if command == "mute":
+            return "mute", (dev.output_id, True)
+        if command == "unmute":
+            return "mute", (dev.output_id, False)
+        if command == "volume_set":
+            return "change_volume", (dev.output_id, int(volume_level * 100))
+        if command == "volume_up":
+            return "change_volume", (dev.output_id, 3, "relative")
+        if command == "volume_down":
+            return "change_volume", (dev.output_id, -3, "relative")
+        if command == "standby":
+            if dev.supports_standby and standby_control:
+                return "standby", (dev.output_id, standby_control[0])
+            return "playback_control", (dev.output_id, "stop")
+        if command == "turn_on":
+            if dev.supports_standby and standby_control:
+                return "convenience_switch", (dev.output_id, standby_control[0])
+            return "playback_control", (dev.output_id, "play")
+        return "playback_control", (dev.output_id, command)
+
+    def get_sync_zones(self, can_group_with_output_ids):
+        ''' return the names of the zones the given outputs belong to'''
+        key = tuple(can_group_with_output_ids)
+        sync_zones = self._sync_zones_cache.get(key)
+        if sync_zones is None:
+            sync_zones = []
+            for output_id in key:
+                zone_id = self._output_zones.get(output_id)
+                if zone_id and self._zone_names[zone_id] not in sync_zones:
+                    sync_zones.append(self._zone_names[zone_id])
+            self._sync_zones_cache[key] = sync_zones
+        return sync_zones
+
+    @staticmethod
+    def _callback_ref(callback):
+        ''' weak reference to a callback, bound methods need a WeakMethod to not die right away'''
+        if hasattr(callback, "__self__"):
+            return weakref.WeakMethod(callback)
+        return weakref.ref(callback)
 
     def add_update_callback(self, callback, device):
         """Register as callback for when a matching device changes."""
-        self._update_callbacks.append([callback, device])
+        self._update_callbacks.setdefault(device, []).append(self._callback_ref(callback))
         _LOGGER.debug('Added update callback for %s', device)
 
     def remove_update_callback(self, callback, device):
         """ Remove a registered update callback. """
-        if [callback, device] in self._update_callbacks:
-            self._update_callbacks.remove([callback, device])
-            _LOGGER.debug('Removed update callback for %s', device)
+        refs = self._update_callbacks.get(device)
+        if not refs:
+            return
+        refs[:] = [ref for ref in refs if ref() is not None and ref() != callback]
+        if not refs:
+            del self._update_callbacks[device]
+        _LOGGER.debug('Removed update callback for %s', device)
 
     def _do_update_callback(self, dev_id):
-        """Call registered callback functions."""
-        for callback, device in self._update_callbacks:
-            if device == dev_id:
+        """Schedule the registered callback functions, all updates of a pass are written in one loop iteration."""
+        if not self._pending_callbacks:
+            self.hass.loop.call_soon(self._flush_update_callbacks)
+        self._pending_callbacks[dev_id] = True
+
+    def _flush_update_callbacks(self):
+        """Call registered callback functions of the updated devices."""
+        dev_ids = self._pending_callbacks
+        self._pending_callbacks = collections.OrderedDict()
+        self.metrics.observe("callbacks_per_pass", len(dev_ids))
+        for device in dev_ids:
+            refs = self._update_callbacks.get(device)
+            if not refs:
+                continue
+            for ref in list(refs):
+                callback = ref()
+                if callback is None:
+                    # the entity was garbage collected without removing its callback
+                    refs.remove(ref)
+                    continue
                 _LOGGER.debug('Call update callback for device %s', device)
-                self.hass.loop.call_soon(callback, dev_id)
+                self.metrics.increment("callbacks_fired")
+                callback(device)
+            if not refs:
+                del self._update_callbacks[device]
+
+    @callback
+    def publish_diagnostics(self, now=None):
+        ''' write the metrics to the diagnostics sensor'''
+        snapshot = self.metrics.snapshot()
+        snapshot["players"] = len(self._devices)
+        snapshot["players_offline"] = len(self.offline_devices)
+        snapshot["host"] = self.host
+        snapshot["connected"] = not self._reconnecting
+        if self._last_event is not None:
+            snapshot["last_event_seconds"] = round(time.monotonic() - self._last_event, 1)
+        self.hass.states.async_set(self._diagnostics_entity, snapshot.get("events_received", 0), snapshot)
 
     @asyncio.coroutine
     def update_volume_slider(self, dev_id, dev_name):
         ''' update volume slider if needed'''
         if self._selected_player != dev_name or not self._init_playlists_done:
             return False
-        slider_vol = float(self.hass.states.get("input_number.roon_volume").state)
+        if self.volume_sync.is_settling(self._devices[dev_id].output_id):
+            # this is the echo of a volume change made with the slider, don't move the slider back,
+            # the slider gets the level roon reached once the volume settled
+            self.after_volume_settled(self._devices[dev_id].output_id,
+                    functools.partial(self.update_volume_slider, dev_id, dev_name))
+            return False
+        slider_vol = float(self.hass.states.get(VOLUME_SLIDER).state)
         output_vol = float(self._devices[dev_id].volume_level)
         if slider_vol != output_vol:
-            _LOGGER.debug("player volume updated, update slider - slider_vol: %s - output_vol: %s" %(slider_vol, output_vol))
+            _LOGGER.debug("player volume updated, update slider - slider_vol: %s - output_vol: %s", slider_vol, output_vol)
+            self.volume_sync.mark_written(VOLUME_SLIDER, output_vol)
             yield from self.hass.services.async_call("input_number", "set_value", 
-                    {"entity_id": "input_number.roon_volume", "value": output_vol})
+                    {"entity_id": VOLUME_SLIDER, "value": output_vol})
         return True
 
+    @staticmethod
+    def get_source_control_state(entity_id, state):
+        ''' the roon source control status for the state of a hass entity'''
+        if "media_player" in entity_id and "roon" in state.attributes.get("source_list", []):
+            if state.attributes.get("source", "") == "roon":
+                return "selected"
+            if state.state == "off":
+                return "standby"
+            return "deselected"
+        return "selected" if state.state == "on" else "standby"
+
     @asyncio.coroutine
     def update_source_control(self, entity_id, old_state, new_state):
-        ''' update the entity state to the roon source/volume control '''
-        entity_obj = self.hass.states.get(entity_id)
+        '''
+            Send the entity state to the roon source/volume control, only when the value roon sees changed.
+            The requests run in the dispatcher, in order per entity.
+        '''
+        if new_state is None:
+            # the entity was removed
+            return
+        name = new_state.attributes.get("friendly_name")
+        jobs = []
         if entity_id in self.source_controls:
-            old_state = old_state.state if old_state else None
-            if "media_player" in entity_id and "roon" in entity_obj.attributes.get("source_list", []):
-                if new_state.attributes.get("source", "") == "roon":
-                    src_state = "selected"
-                elif new_state.state == "off":
-                    src_state = "standby"
+            src_state = self.get_source_control_state(entity_id, new_state)
+            if self._source_control_states.get(entity_id) != src_state:
+                self._source_control_states[entity_id] = src_state
+                if entity_id in self.registered_source_controls:
+                    self.dispatcher.submit(entity_id, "update_source_control", entity_id, src_state)
                 else:
-                    src_state = "deselected"
-            else:
-                src_state = "selected" if new_state.state == "on" else "standby"
-            if not entity_id in self.registed_source_controls:
-                # register as source control
-                self.registed_source_controls.append(entity_id)
-                self.roonapi.register_source_control(entity_id, entity_obj.attributes.get("friendly_name"), 
-                        self.roon_source_control_callback, src_state)
-            else:
-                new_state = new_state.state if new_state else None
-                self.roonapi.update_source_control(entity_id, src_state)
-        if entity_id in self.volume_controls:
-            cur_vol = entity_obj.attributes.get("volume_level", 0) * 100
-            cur_mute = entity_obj.attributes.get("is_volume_muted", False)
-            if not entity_id in self.registered_volume_controls:
-                # register as volume control
-                self.registered_volume_controls.append(entity_id)
-                self.roonapi.register_volume_control(entity_id, entity_obj.attributes.get("friendly_name"), 
-                        self.roon_volume_control_callback, cur_vol, is_muted=cur_mute)
-            else:
-                self.roonapi.update_volume_control(entity_id, cur_vol, cur_mute)
+                    # later updates are queued behind the registration
+                    self.registered_source_controls.add(entity_id)
+                    jobs.append(self._async_register_control(self.registered_source_controls,
+                            self._source_control_states, entity_id, "register_source_control", name,
+                            self.roon_source_control_callback, src_state))
+        if entity_id in self.volume_controls and self.volume_sync.is_settling(entity_id):
+            # while roon is changing the volume of this entity, don't echo the intermediate levels back,
+            # the state of the entity is sent once the volume settled
+            self.after_volume_settled(entity_id, functools.partial(self._async_resend_control, entity_id))
+        elif entity_id in self.volume_controls:
+            cur_vol = (new_state.attributes.get("volume_level") or 0) * 100
+            cur_mute = new_state.attributes.get("is_volume_muted", False)
+            if self._volume_control_states.get(entity_id) != (cur_vol, cur_mute):
+                self._volume_control_states[entity_id] = (cur_vol, cur_mute)
+                if entity_id in self.registered_volume_controls:
+                    self.dispatcher.submit(entity_id, "update_volume_control", entity_id, cur_vol, cur_mute)
+                else:
+                    # later updates are queued behind the registration
+                    self.registered_volume_controls.add(entity_id)
+                    jobs.append(self._async_register_control(self.registered_volume_controls,
+                            self._volume_control_states, entity_id, "register_volume_control", name,
+                            self.roon_volume_control_callback, cur_vol, is_muted=cur_mute))
+        if jobs:
+            yield from asyncio.gather(*jobs)
+
+    @asyncio.coroutine
+    def _async_resend_control(self, entity_id):
+        ''' send the current state of an entity to its roon controls, if it differs from the last one sent'''
+        yield from self.update_source_control(entity_id, None, self.hass.states.get(entity_id))
+
+    @callback
+    def after_volume_settled(self, key, job):
+        ''' run the coroutine function job once the volume changes for key settled, once per key'''
+        if key in self._settle_checks:
+            return
+        self._settle_checks.add(key)
+        self.hass.loop.call_later(self.volume_sync.settle_remaining(key), self._run_after_settled, key, job)
+
+    @callback
+    def _run_after_settled(self, key, job):
+        ''' run the job of after_volume_settled, or wait again if more changes were sent meanwhile'''
+        self._settle_checks.discard(key)
+        if self.volume_sync.is_settling(key):
+            self.after_volume_settled(key, job)
+        else:
+            ensure_future(job(), loop=self.hass.loop)
+
+    @asyncio.coroutine
+    def _async_register_control(self, registered, states, entity_id, method, *args, **kwargs):
+        ''' register a source or volume control with roon, returns True if roon accepted it'''
+        try:
+            yield from asyncio.wrap_future(self.dispatcher.submit(entity_id, method, entity_id, *args, **kwargs),
+                    loop=self.hass.loop)
+        except Exception:
+            # already logged by the dispatcher, try again on the next state change
+            registered.discard(entity_id)
+            states.pop(entity_id, None)
+            return False
+        return True
+
+    @asyncio.coroutine
+    def async_register_controls(self):
+        ''' register all configured source/volume controls at once, with the current state of their entities'''
+        jobs = []
+        for entity_id in self.source_controls | self.volume_controls:
+            entity_obj = self.hass.states.get(entity_id)
+            if entity_obj:
+                jobs.append(self.update_source_control(entity_id, None, entity_obj))
+        if jobs:
+            yield from asyncio.gather(*jobs)
+        _LOGGER.debug("registered %s source and %s volume controls", len(self.registered_source_controls),
+                len(self.registered_volume_controls))
 
     @asyncio.coroutine
     def input_select_players_updated(self, selected_player):
@@ -656,42 +1562,40 @@ class RoonServer(object):
         player_volume = 0
         player_entity = ""
         # get player entity_id and volume level
-        for dev in self._devices.values():
-            if dev.name == selected_player:
-                player_volume = dev.volume_level
-                player_entity = dev.entity_id
-                break
+        dev = self.get_device_by_name(selected_player)
+        if dev:
+            player_volume = dev.volume_level
+            player_entity = dev.entity_id
         if selected_player == self._initial_player:
             # the player-selector was restored to the default selection, ignore...
             yield from self.hass.services.async_call("input_number", "set_value", 
-                    {"entity_id": "input_number.roon_volume", "value": 0})
+                    {"entity_id": VOLUME_SLIDER, "value": 0})
         else:
             # new player chosen - set volume slider
-            _LOGGER.debug("update volumeslider for player %s to %s" %(player_entity, player_volume))
+            _LOGGER.debug("update volumeslider for player %s to %s", player_entity, player_volume)
+            self.volume_sync.mark_written(VOLUME_SLIDER, player_volume)
             yield from self.hass.services.async_call("input_number", "set_value", 
-                {"entity_id": "input_number.roon_volume", "value": player_volume})
+                {"entity_id": VOLUME_SLIDER, "value": player_volume})
 
     @asyncio.coroutine
     def input_select_playlists_updated(self, selected_playlist):
         ''' the input select with playlists has changed state '''
-        _LOGGER.debug("input_select_playlists_updated - selected playlist: %s" % selected_playlist)
+        _LOGGER.debug("input_select_playlists_updated - selected playlist: %s", selected_playlist)
         selected_player = self.hass.states.get("input_select.roon_players").state
         # get player entity_id
-        player_entity = ""
-        for dev in self._devices.values():
-            if dev.name == selected_player:
-                player_entity = dev.entity_id
-                break
+        dev = self.get_device_by_name(selected_player)
+        player_entity = dev.entity_id if dev else ""
         if selected_playlist == self._initial_playlist:
             # the playlist-selector was restored to default selection, ignore...
             return
         else:
             # new playlist chosen, start playback
-            if selected_playlist in self.roonapi.internet_radio():
-                media_content_type = "radio"
-            else:
+            media_content_type = self.catalog.media_type(selected_playlist)
+            if not media_content_type:
+                # not (yet) in the catalog, refresh on the next pass
+                self.catalog.invalidate()
                 media_content_type = "playlist"
-            _LOGGER.info("start %s %s on player %s" %(media_content_type, selected_playlist, player_entity))
+            _LOGGER.info("start %s %s on player %s", media_content_type, selected_playlist, player_entity)
             yield from self.hass.services.async_call("media_player", "play_media", 
                     {"entity_id": player_entity, "media_content_id": selected_playlist, "media_content_type": media_content_type})
             # restore playlist selector to default value
@@ -706,45 +1610,47 @@ class RoonServer(object):
         player_entity = ""
         player_state = STATE_OFF
         # get player entity_id and volume level
-        for dev in self._devices.values():
-            if dev.name == selected_player:
-                player_volume = dev.volume_level
-                player_entity = dev.entity_id
-                player_state = dev.state
-                break
+        dev = self.get_device_by_name(selected_player)
+        if dev:
+            player_volume = dev.volume_level
+            player_entity = dev.entity_id
+            player_state = dev.state
         if not player_entity:
             return
+        if self.volume_sync.is_echo(VOLUME_SLIDER, selected_volume):
+            # we moved the slider ourselves to reflect the player volume
+            return
         if selected_volume == 0:
             # volume slider set to 0, treat this as power off
             yield from asyncio.sleep(0.5, self.hass.loop)
             # double check to prevent some race condition
             if self.hass.states.get("input_select.roon_players").state == self._initial_player:
                 return
-            _LOGGER.debug("turn off player %s" %(player_entity))
+            _LOGGER.debug("turn off player %s", player_entity)
             yield from self.hass.services.async_call("media_player", "turn_off", 
                 {"entity_id": player_entity})
         else:
             # volume slider changed, set new volume and turn on player if needed
             if player_state == STATE_OFF:
-                _LOGGER.debug("turn on player %s" %(player_entity))
+                _LOGGER.debug("turn on player %s", player_entity)
                 yield from self.hass.services.async_call("media_player", "turn_on", 
                     {"entity_id": player_entity})
             if selected_volume != player_volume:
-                _LOGGER.debug("change volume for player %s to %s" %(player_entity, selected_volume))
+                _LOGGER.debug("change volume for player %s to %s", player_entity, selected_volume)
                 yield from self.hass.services.async_call("media_player", "volume_set", 
                     {"entity_id": player_entity, "volume_level": selected_volume})
 
     @asyncio.coroutine
     def hass_event(self, changed_entity, from_state, to_state):
         ''' event fired when one of our monitored entities changes state '''
-        _LOGGER.debug("hass_event event fired --> %s changed" % (changed_entity))
+        _LOGGER.debug("hass_event event fired --> %s changed", changed_entity)
         if changed_entity in self.source_controls or changed_entity in self.volume_controls:
             return self.update_source_control(changed_entity, from_state, to_state)
         elif changed_entity == "input_select.roon_players":
             return self.input_select_players_updated(to_state.state)
         elif changed_entity == "input_select.roon_playlists":
             return self.input_select_playlists_updated(to_state.state)
-        elif changed_entity == "input_number.roon_volume":
+        elif changed_entity == VOLUME_SLIDER:
             return self.volume_slider_updated(float(to_state.state))
 
     @asyncio.coroutine
@@ -755,20 +1661,269 @@ class RoonServer(object):
         while not self._exit:
             yield from self.update_players()
             yield from self.update_playlists()
+            yield from self.async_save_state()
+            yield from self.library.async_refresh()
             yield from asyncio.sleep(UPDATE_PLAYLISTS_INTERVAL, self.hass.loop)
 
+    @asyncio.coroutine
+    def async_watchdog(self, now=None):
+        '''
+            Check the connection, runs every WATCHDOG_INTERVAL.
+            Events prove the connection is alive, only an idle connection is probed.
+            After WATCHDOG_FAILURES failed probes in a row the connection is replaced.
+        '''
+        if self._exit or self._reconnecting or self._last_event is None:
+            # not connected yet (e.g. waiting for approval in roon) or already reconnecting
+            return
+        if time.monotonic() - self._last_event < WATCHDOG_IDLE:
+            self._probe_failures = 0
+            return
+        if (yield from self._async_probe()):
+            self._probe_failures = 0
+            # the core is quiet, no need to probe again right away
+            self._last_event = time.monotonic()
+            return
+        self._probe_failures += 1
+        self.metrics.increment("probe_failures")
+        if self._probe_failures >= WATCHDOG_FAILURES:
+            self._probe_failures = 0
+            yield from self._async_reconnect()
+
+    @asyncio.coroutine
+    def _async_probe(self):
+        ''' a single browse request, True if the core answered within WATCHDOG_TIMEOUT'''
+        start = time.monotonic()
+        try:
+            with async_timeout.timeout(WATCHDOG_TIMEOUT, loop=self.hass.loop):
+                result = yield from self.hass.loop.run_in_executor(None, self.roonapi.browse_browse,
+                        {"hierarchy": "browse", "multi_session_key": WATCHDOG_SESSION, "pop_all": True})
+        except asyncio.TimeoutError:
+            _LOGGER.debug("Roon core %s didn't answer within %s seconds", self.host or "", WATCHDOG_TIMEOUT)
+            return False
+        except Exception as exc:
+            _LOGGER.debug("Roon core %s probe failed: %s", self.host or "", exc)
+            return False
+        self.metrics.observe("probe", time.monotonic() - start)
+        return bool(result)
+
+    @asyncio.coroutine
+    def _async_reconnect(self):
+        ''' replace the connection until the core answers, with exponential backoff, then resync'''
+        self._reconnecting = True
+        delay = RECONNECT_MIN_DELAY
+        start = time.monotonic()
+        try:
+            while not self._exit:
+                _LOGGER.warning("Roon core %s is not responding, reconnecting", self.host or "")
+                self.metrics.increment("reconnects")
+                old_api = self.roonapi
+                yield from self.hass.loop.run_in_executor(None, old_api.stop)
+                roonapi = yield from self.hass.loop.run_in_executor(None, self._connect, old_api.token)
+                self.set_roonapi(roonapi)
+                if (yield from self._async_wait_connected()):
+                    break
+                yield from asyncio.sleep(delay, self.hass.loop)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            if self._exit:
+                return
+            _LOGGER.warning("Reconnected to Roon core %s", self.host or "")
+            self._last_event = time.monotonic()
+            yield from self.async_resync()
+            self.metrics.observe("reconnect", time.monotonic() - start)
+        finally:
+            self._reconnecting = False
+
+    @asyncio.coroutine
+    def _async_wait_connected(self):
+        ''' wait until the new connection reported its zones, or answers a probe if it has none'''
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            if self.roonapi.zones:
+                return True
+            yield from asyncio.sleep(0.5, self.hass.loop)
+        result = yield from self._async_probe()
+        return result
+
+    def set_roonapi(self, roonapi):
+        ''' switch to a new connection, the state of the old one is not valid for it'''
+        self.roonapi = roonapi
+        self.catalog.roonapi = roonapi
+        self.library.roonapi = roonapi
+        self.browser.roonapi = roonapi
+        # item keys of the old browse session
+        self.browser.invalidate()
+        # image urls carry the host and port of the old connection
+        self._image_urls.clear()
+        # the controls were registered with the old connection
+        self.registered_source_controls.clear()
+        self.registered_volume_controls.clear()
+        self._source_control_states.clear()
+        self._volume_control_states.clear()
+        self.roonapi.register_state_callback(self.roonapi_state_callback,
+                event_filter=["zones_changed", "zones_seek_changed", "outputs_changed"])
+
+    @asyncio.coroutine
+    def async_resync(self):
+        '''
+            Bring the players in line with a fresh snapshot of the zones, e.g. after a reconnect.
+            Only zones whose players differ from the known state go through update_changed_players,
+            the other zones only get their seek position. The playlist widget is only updated if the catalog changed.
+        '''
+        with self._pending_lock:
+            # the snapshot covers the zone events received so far, like the initial ones of a new connection
+            self._pending_zones.clear()
+        zones = self.roonapi.zones
+        changed_zones = [zone_id for zone_id in self._zone_outputs if zone_id not in zones]
+        unchanged_zones = []
+        for zone_id, zone in list(zones.items()):
+            if self.zone_changed(zone):
+                changed_zones.append(zone_id)
+            else:
+                unchanged_zones.append(zone_id)
+        self.metrics.increment("resync_zones_changed", len(changed_zones))
+        self.metrics.increment("resync_zones_unchanged", len(unchanged_zones))
+        _LOGGER.debug("resync: %s zones changed, %s unchanged", len(changed_zones), len(unchanged_zones))
+        if changed_zones:
+            yield from self.update_changed_players(changed_zones)
+        self.update_seek_positions(unchanged_zones)
+        # outputs which are no longer in any zone
+        self.update_removed_outputs([dev.output_id for dev in self._devices.values()
+                if dev.output_id not in self._output_zones])
+        if self.namespace or not self._init_playlists_done:
+            return
+        # the catalog may have changed meanwhile, the content hash tells if the widget needs an update
+        if (yield from self.catalog.async_refresh(force=True)):
+            yield from self.update_playlists_select()
+        ensure_future(self.async_register_controls(), loop=self.hass.loop)
+
+    def zone_changed(self, zone):
+        ''' True if a player of the zone differs from the known state, apart from the seek position'''
+        zone_state = RoonZoneState.from_zone(zone)
+        for output in zone["outputs"]:
+            if output["display_name"] == "Unnamed" or not output["display_name"]:
+                continue
+            dev_id = self.get_dev_id(output)
+            dev = self._devices.get(dev_id)
+            if not dev or dev.provisional or dev_id in self.offline_devices:
+                return True
+            if _player_fingerprint(dev.player_data) != _player_fingerprint(
+                    RoonPlayerData.from_output(dev_id, output, zone_state)):
+                return True
+        return False
+
+    @asyncio.coroutine
+    def async_save_state(self):
+        ''' persist the known players and the catalog, so they can be restored on the next start'''
+        if not self._state_file:
+            return
+        devices = [dev.get_snapshot() for dev in self._devices.values() if not dev.provisional]
+        if not devices:
+            # nothing live yet, keep the previous state
+            return
+        data = {"version": STATE_VERSION, "devices": devices, "catalog": self.catalog.export()}
+        try:
+            yield from self.hass.loop.run_in_executor(None, self._write_state, data)
+        except (OSError, TypeError, ValueError) as exc:
+            _LOGGER.error("Unable to save Roon state to %s: %s", self._state_file, exc)
+
+    def _write_state(self, data):
+        ''' write the state file (runs in the executor)'''
+        with open(self._state_file + ".tmp", "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(self._state_file + ".tmp", self._state_file)
+
+    @asyncio.coroutine
+    def async_restore_state(self):
+        ''' restore the players and catalog of the previous run as provisional entities'''
+        yield from self.library.async_load()
+        if not self._state_file:
+            return
+        try:
+            data = yield from self.hass.loop.run_in_executor(None, self._read_state)
+        except (OSError, ValueError) as exc:
+            _LOGGER.error("Unable to restore Roon state from %s: %s", self._state_file, exc)
+            return
+        if not data or data.get("version") != STATE_VERSION:
+            return
+        self.catalog.restore(data.get("catalog", []))
+        new_devices = []
+        zone_states = {}
+        for snapshot in data.get("devices", []):
+            sources = snapshot.pop("sources", [])
+            try:
+                player_data = RoonPlayerData.from_dict(snapshot)
+            except (KeyError, TypeError) as exc:
+                _LOGGER.warning("Unable to restore Roon player %s: %s", snapshot.get("dev_id"), exc)
+                continue
+            # share the zone state between the outputs of a zone, like update_changed_players does
+            player_data.zone = zone_states.setdefault(player_data.zone.zone_id, player_data.zone)
+            dev_id = player_data.dev_id
+            if dev_id in self._devices:
+                continue
+            player_data.last_changed = utcnow()
+            player = RoonDevice(self, player_data)
+            player.provisional = True
+            player.set_sources(sources)
+            self._devices[dev_id] = player
+            self._devices_by_name[player.name] = dev_id
+            self._devices_by_output[player.output_id] = dev_id
+            if not player.available:
+                # offline in the previous run, it comes back online like any other offline player
+                self.offline_devices.add(dev_id)
+            new_devices.append(player)
+        if new_devices:
+            _LOGGER.debug("restored %s players from the previous run", len(new_devices))
+            self._add_devices_callback(new_devices, False)
+            self.hass.loop.call_later(PROVISIONAL_TIMEOUT, self._expire_provisional)
+
+    def _read_state(self):
+        ''' read the state file (runs in the executor)'''
+        if not os.path.isfile(self._state_file):
+            return None
+        with open(self._state_file) as f:
+            return json.load(f)
+
+    @callback
+    def _expire_provisional(self):
+        ''' players restored from the previous run which roon didn't report (yet) are unavailable'''
+        for dev_id, dev in list(self._devices.items()):
+            if dev.provisional and dev_id not in self.offline_devices:
+                self.set_device_offline(dev_id)
+
     @asyncio.coroutine
     def update_changed_players(self, changed_zones_ids):
         """Update the players which were reported as changed by the Roon API"""
         new_devices = []
         force_playlist_update = False
+        updated = skipped = 0
+        self.metrics.observe("zones_per_pass", len(changed_zones_ids))
 
-        #build devices listing
+        # index all changed zones first, the source list of every player is built from the complete index
+        zones = []
+        index_changed = False
         for zone_id in changed_zones_ids:
-            if zone_id not in self.roonapi.zones:
-                # device was removed ?
+            zone = self.roonapi.zones.get(zone_id)
+            if zone is None:
+                # zone was removed, its outputs may be gone as well
+                removed_outputs = self.get_zone_outputs(zone_id)
+                index_changed = index_changed or zone_id in self._zone_names
+                self.remove_zone_index(zone_id)
+                self.update_removed_outputs(removed_outputs)
                 continue
-            zone = self.roonapi.zones[zone_id]
+            if self.update_zone_index(zone_id, zone):
+                index_changed = True
+            zones.append(zone)
+
+        #build devices listing
+        updated_ids = set()
+        slice_start = time.monotonic()
+        for zone in zones:
+            if time.monotonic() - slice_start > UPDATE_SLICE:
+                # let the loop run other work, like the updates of other cores, during a big pass
+                yield from asyncio.sleep(0, self.hass.loop)
+                slice_start = time.monotonic()
+            # the zone state is shared by all outputs of the zone
+            zone_state = RoonZoneState.from_zone(zone)
             for device in zone["outputs"]:
 
                 dev_name = device['display_name']
@@ -776,25 +1931,70 @@ class RoonServer(object):
                     # ignore unnamed devices
                     continue
 
-                player_data = yield from self.create_player_data(zone, device)
-                dev_id = player_data["dev_id"]
-                player_data["is_available"] = True
+                start = time.perf_counter()
+                player_data = self.create_player_data(zone_state, device)
+                self.metrics.observe("create_player_data", time.perf_counter() - start)
+                dev_id = player_data.dev_id
+                updated_ids.add(dev_id)
+                previous_id = self._devices_by_output.get(device["output_id"])
+                if previous_id != dev_id and previous_id in self._devices:
+                    # the output was renamed in roon, the player id is derived from the name so it becomes
+                    # a new player, the old one stays unavailable
+                    previous = self._devices[previous_id]
+                    _LOGGER.info("player %s was renamed to %s", previous.name, dev_name)
+                    if self._devices_by_name.get(previous.name) == previous_id:
+                        del self._devices_by_name[previous.name]
+                    if previous_id not in self.offline_devices:
+                        self.set_device_offline(previous_id)
+                known = self._devices.get(dev_id)
+                if known and known.output_id != device["output_id"] and \
+                        self._devices_by_output.get(known.output_id) == dev_id:
+                    # roon gave the output a new id, the old one is not a removed output
+                    del self._devices_by_output[known.output_id]
+                self._devices_by_output[device["output_id"]] = dev_id
                 if not dev_id in self._devices:
                     # new player added !
-                    _LOGGER.debug("New player added: %s" % dev_name)
+                    _LOGGER.debug("New player added: %s", dev_name)
                     player = RoonDevice(self, player_data)
                     new_devices.append(player)
                     self._devices[dev_id] = player
+                    self._devices_by_name[dev_name] = dev_id
                 else:
                     # device was updated
-                    if dev_id in self.offline_devices:
-                        _LOGGER.debug("player back online: %s" % self._devices[dev_id].entity_id)
+                    self._devices[dev_id].provisional = False
+                    old_name = self._devices[dev_id].name
+                    if old_name != dev_name:
+                        # renamed in roon, only in case or punctuation as the player id didn't change
+                        if self._devices_by_name.get(old_name) == dev_id:
+                            del self._devices_by_name[old_name]
+                        _LOGGER.debug("player renamed: %s -> %s", old_name, dev_name)
+                    self._devices_by_name[dev_name] = dev_id
+                    back_online = dev_id in self.offline_devices
+                    if back_online:
+                        _LOGGER.debug("player back online: %s", self._devices[dev_id].entity_id)
                         force_playlist_update = True
-                        self.offline_devices.remove(dev_id)
+                        self.offline_devices.discard(dev_id)
                         self._devices[dev_id].set_available(True)
-                    self._devices[dev_id].update_data(player_data)
+                    if self._devices[dev_id].update_data(player_data) or back_online:
+                        updated += 1
+                        self._do_update_callback(dev_id)
+                        if dev_name == self._selected_player:
+                            yield from self.update_volume_slider(dev_id, dev_name)
+                    else:
+                        # nothing changed that hass can see, skip the state write
+                        skipped += 1
+
+        if index_changed:
+            # zones were added, removed or renamed, which changes the source list of the other players too
+            for dev_id, dev in list(self._devices.items()):
+                if dev_id not in updated_ids and dev.update_sources():
+                    updated += 1
                     self._do_update_callback(dev_id)
-                    yield from self.update_volume_slider(dev_id, dev_name)
+
+        self.skipped_updates += skipped
+        self.metrics.increment("state_writes_skipped", skipped)
+        _LOGGER.debug("processed %s zones: %s players updated, %s unchanged (%s state writes saved in total)",
+                len(changed_zones_ids), updated, skipped, self.skipped_updates)
 
         if new_devices:
             force_playlist_update = True
@@ -803,30 +2003,90 @@ class RoonServer(object):
         if force_playlist_update:
             yield from self.update_playlists()
 
+    @callback
+    def update_seek_positions(self, zone_ids):
+        ''' lightweight update for seek events, only touches the media position of the outputs'''
+        for zone_id in zone_ids:
+            zone = self.roonapi.zones.get(zone_id)
+            if not zone or "now_playing" not in zone:
+                continue
+            # roonapi only updates the top level seek_position on a seek event, not the one in now_playing
+            seek_position = zone.get("seek_position")
+            for output in zone["outputs"]:
+                dev_id = self.get_dev_id(output)
+                if dev_id in self._devices and self._devices[dev_id].update_position(seek_position):
+                    self._do_update_callback(dev_id)
+
+    @asyncio.coroutine
+    def update_removed(self):
+        '''
+            roonapi drops removed zones and outputs without firing a callback,
+            so diff the known zones and outputs against the live ones.
+        '''
+        zones = self.roonapi.zones
+        removed_zones = [zone_id for zone_id in self._zone_outputs if zone_id not in zones]
+        if removed_zones:
+            yield from self.update_changed_players(removed_zones)
+        outputs = self.roonapi.outputs
+        # the current output id of every player, not the ids it had before
+        self.update_removed_outputs([dev.output_id for dev in list(self._devices.values())
+                if dev.output_id not in outputs])
+
+    @callback
+    def update_removed_outputs(self, output_ids):
+        ''' mark the players of removed outputs unavailable right away'''
+        for output_id in output_ids:
+            if output_id in self.roonapi.outputs:
+                continue
+            dev_id = self._devices_by_output.get(output_id)
+            if dev_id in self._devices and dev_id not in self.offline_devices:
+                self.set_device_offline(dev_id)
+
+    @callback
+    def set_device_offline(self, dev_id):
+        ''' mark a player unavailable'''
+        entity_id = self._devices[dev_id].entity_id
+        if not entity_id:
+            # not yet added to hass
+            return
+        _LOGGER.info("player removed/offline: %s", entity_id)
+        self.offline_devices.add(dev_id)
+        self._devices[dev_id].set_available(False)
+        self._do_update_callback(dev_id)
+
     @asyncio.coroutine
     def update_players(self):
-        ''' periodic scan of all devices'''
-        devs = self.roonapi.zones.keys()
-        yield from self.update_changed_players(devs)
+        '''
+            Periodic consistency check of all devices.
+            Changes are picked up from the roon events, this only catches zones and outputs
+            for which an event was missed.
+        '''
+        zones = self.roonapi.zones
+        # drop zones from the index which no longer exist
+        for zone_id in list(self._zone_outputs.keys()):
+            if zone_id not in zones:
+                self.remove_zone_index(zone_id)
+        missed_zones = [zone_id for zone_id, zone in list(zones.items())
+                if self._zone_outputs.get(zone_id) != tuple(output["output_id"] for output in zone["outputs"])]
+        if missed_zones:
+            _LOGGER.debug("consistency check: %s zones out of sync", len(missed_zones))
+            yield from self.update_changed_players(missed_zones)
         # check for any removed devices
-        for dev_id, dev in self._devices.items():
-            if dev.output_id not in self.roonapi.outputs and dev_id not in self.offline_devices:
-                entity_id = dev.entity_id
-                if entity_id:
-                    _LOGGER.info("player removed/offline: %s" % entity_id)
-                    self.offline_devices.append(dev_id)
-                    self._devices[dev_id].set_available(False)
-                    self._do_update_callback(dev_id)
+        self.update_removed_outputs([dev.output_id for dev in self._devices.values()
+                if dev.output_id not in self._output_zones])
 
     @asyncio.coroutine        
     def update_playlists(self):
         ''' update the playlists and players input_selects'''
+        if self.namespace:
+            # the player widget and the source/volume controls belong to the first core
+            return False
         try:
             if not self._initial_playlist:
                 self._initial_playlist = self.hass.states.get("input_select.roon_playlists").state
             if not self._initial_player:
                 self._initial_player = self.hass.states.get("input_select.roon_players").state
-            volume_slider = self.hass.states.get("input_number.roon_volume").state
+            volume_slider = self.hass.states.get(VOLUME_SLIDER).state
         except AttributeError:
             _LOGGER.warning("input_number and input_select objects do not (yet) exist. Skip playlist generation...")
             return False
@@ -835,7 +2095,7 @@ class RoonServer(object):
         all_player_names = [self._initial_player]
         all_player_entities = []
         for dev in self._devices.values():
-            if dev.output_id not in self.offline_devices:
+            if dev.unique_id not in self.offline_devices:
                 entity_id = dev.entity_id
                 if not entity_id:
                     entity_id = "media_player.%s" % dev.name.lower().replace(" ", "_")
@@ -843,7 +2103,7 @@ class RoonServer(object):
                 all_player_names.append(dev.name)
 
         # fill input select with player names
-        if len(str(all_player_names)) != len(str(self.all_player_names)):
+        if all_player_names != self.all_player_names:
             # only (re)fill the listing if there are changes
             self.all_player_names = all_player_names
             yield from self.hass.services.async_call("input_select", 
@@ -852,55 +2112,922 @@ class RoonServer(object):
                     "select_option", {"entity_id": "input_select.roon_players", "option": self._initial_player})
         
         # fill group.roon_players
-        if len(str(all_player_entities)) != len(str(self.all_player_entities)):
+        if all_player_entities != self.all_player_entities:
             # only (re)fill the listing if there are changes
             self.all_player_entities = all_player_entities
             yield self.hass.states.async_set("group.roon_players", "", {"entity_id": all_player_entities})
         
-        # fill playlists input_select
-        all_playlists = [self._initial_playlist]
-        roon_playlists = self.roonapi.playlists()
-        if roon_playlists and "items" in roon_playlists:
-            all_playlists += [item["title"] for item in roon_playlists["items"]]
-        roon_playlists = self.roonapi.internet_radio()
-        if roon_playlists and "items" in roon_playlists:
-            all_playlists += [item["title"] for item in roon_playlists["items"]]
-        if len(str(all_playlists)) != len(str(self.all_playlists)):
-            # only send update to hass if there were changes
-            self.all_playlists = all_playlists
-            yield from self.hass.services.async_call("input_select", "set_options", 
-                    {"entity_id": "input_select.roon_playlists", "options": all_playlists})
-            yield from self.hass.services.async_call("input_select", "select_option", 
-                    {"entity_id": "input_select.roon_playlists", "option": self._initial_playlist})
+        # fill playlists input_select, a catalog restored from the previous run is shown right away
+        yield from self.update_playlists_select()
+        start = time.monotonic()
+        yield from self.catalog.async_refresh()
+        self.metrics.observe("playlist_refresh", time.monotonic() - start)
+        yield from self.update_playlists_select()
         
         # register callback to track state changes of our special input selects
         if not self._init_playlists_done:
             self._init_playlists_done = True
-            track_entities = ["input_select.roon_playlists", "input_select.roon_players", "input_number.roon_volume"]
+            track_entities = ["input_select.roon_playlists", "input_select.roon_players", VOLUME_SLIDER]
             # also register the source/volume controls and send current state
             if self.source_controls or self.volume_controls:
-                entity_ids = self.source_controls + self.volume_controls
-                track_entities += entity_ids
-                for entity_id in entity_ids:
-                    entity_obj = self.hass.states.get(entity_id)
-                    if entity_obj:
-                        # send current state right away if the entity is already present in hass
-                        asyncio.run_coroutine_threadsafe(self.update_source_control(entity_id, entity_obj, entity_obj), self.hass.loop)
+                track_entities += list(self.source_controls | self.volume_controls)
+                ensure_future(self.async_register_controls(), loop=self.hass.loop)
             event.async_track_state_change(self.hass, track_entities, self.hass_event)
         _LOGGER.debug("updated playlists")
         return True
 
     @asyncio.coroutine
-    def create_player_data(self, zone, output):
-        ''' create player object dict by combining zone with output'''
-        new_dict = zone.copy()
-        new_dict.update(output)
-        new_dict.pop("outputs")
-        new_dict["is_synced"] = len(zone["outputs"]) > 1
-        new_dict["zone_name"] = zone["display_name"]
-        new_dict["display_name"] = output["display_name"]
-        new_dict["last_changed"] = utcnow()
+    def update_playlists_select(self):
+        ''' fill the playlists input_select with the catalog'''
+        if self.catalog.fingerprint != self._playlists_fingerprint:
+            # only send update to hass if there were changes
+            self._playlists_fingerprint = self.catalog.fingerprint
+            all_playlists = [self._initial_playlist] + self.catalog.titles
+            self.all_playlists = all_playlists
+            yield from self.hass.services.async_call("input_select", "set_options", 
+                    {"entity_id": "input_select.roon_playlists", "options": all_playlists})
+            yield from self.hass.services.async_call("input_select", "select_option", 
+                    {"entity_id": "input_select.roon_playlists", "option": self._initial_playlist})
+
+    def create_player_data(self, zone_state, output):
+        ''' create the player record of an output'''
+        player_data = RoonPlayerData.from_output(self.get_dev_id(output), output, zone_state)
+        player_data.last_changed = utcnow()
+        return player_data
+
+    def get_dev_id(self, output):
+        ''' unique id for the player of an output, within the namespace of the core'''
         # we don't use the zone_id or output_id for now as unique id as I've seen cases were it changes for some reason
-        new_dict["dev_id"] = "roon_%s" % output["display_name"].lower().replace(" ","_").replace("-","_")
-        return new_dict
+        name = output["display_name"].lower().replace(" ","_").replace("-","_")
+        if self.namespace:
+            return "roon_%s_%s" % (self.namespace, name)
+        return "roon_%s" % name
+
+
+class RoonCatalog(object):
+    """Cache of the Roon playlists and internet radio stations."""
+
+    def __init__(self, hass, roonapi, ttl=CATALOG_TTL):
+        """Initialize the catalog."""
+        self.hass = hass
+        self.roonapi = roonapi
+        self._ttl = ttl
+        self._titles = []
+        self._media_types = {}
+        self._fingerprint = None
+        self._last_refresh = None
+        self._fetch_job = None
+
+    @property
+    def titles(self):
+        ''' all playlist and radio titles'''
+        return self._titles
+
+    @property
+    def fingerprint(self):
+        ''' hash of the catalog content, changes when any item is added, removed or renamed'''
+        return self._fingerprint
+
+    def media_type(self, title):
+        ''' return the media type (playlist or radio) for the given title'''
+        return self._media_types.get(title)
+
+    def invalidate(self):
+        ''' force a refresh on the next call to async_refresh'''
+        self._last_refresh = None
+
+    def export(self):
+        ''' the catalog items as a list of [title, media type]'''
+        return [[title, self._media_types[title]] for title in self._titles]
+
+    def restore(self, items):
+        ''' restore the items of a previous export, the catalog is refreshed on the next call to async_refresh'''
+        self._set_items([tuple(item) for item in items])
+
+    @asyncio.coroutine
+    def async_refresh(self, force=False):
+        ''' refresh the catalog if it is expired, returns True if the content changed'''
+        if not force and self._last_refresh and time.monotonic() - self._last_refresh < self._ttl:
+            return False
+        # the browse calls are blocking, run them in the executor and share a running fetch
+        fetch_job = self._fetch_job
+        if fetch_job is None:
+            fetch_job = self._fetch_job = self.hass.loop.run_in_executor(None, self._fetch)
+        try:
+            items = yield from fetch_job
+        except Exception as exc:
+            _LOGGER.error("Unable to retrieve playlists from Roon: %s", exc)
+            return False
+        finally:
+            self._fetch_job = None
+        self._last_refresh = time.monotonic()
+        if not self._set_items(items):
+            return False
+        _LOGGER.debug("catalog changed: %s items", len(items))
+        return True
+
+    def _set_items(self, items):
+        ''' replace the items, returns True if the content changed'''
+        fingerprint = hash(tuple(items))
+        if fingerprint == self._fingerprint:
+            return False
+        self._fingerprint = fingerprint
+        self._titles = [title for title, _ in items]
+        self._media_types = dict(items)
+        return True
+
+    def _fetch(self):
+        ''' fetch playlists and radio stations from roon (runs in the executor)'''
+        items = []
+        for media_type, result in (("playlist", self.roonapi.playlists()),
+                ("radio", self.roonapi.internet_radio())):
+            if result and "items" in result:
+                items += [(item["title"], media_type) for item in result["items"]]
+        return items
+
+
+def _normalize(title):
+    ''' the form of a title used for matching'''
+    return " ".join(title.casefold().split())
+
+
+def _browse_load(roonapi, opts, offset=0, count=LIBRARY_PAGE_SIZE):
+    ''' load a page of the current list of a browse session'''
+    result = roonapi.browse_load(dict(opts, offset=offset, count=count))
+    if not result or "items" not in result:
+        return []
+    return result["items"]
+
+
+def _find_item(items, title, subtitle=None):
+    ''' the browse item with the given title (and subtitle)'''
+    for item in items:
+        if item["title"] == title and (not subtitle or item.get("subtitle") == subtitle):
+            return item
+    return None
+
+
+def _browse_open(roonapi, opts, path):
+    ''' browse to the given path, returns the number of items in the list (None if not found)'''
+    roonapi.browse_browse(dict(opts, pop_all=True))
+    items = _browse_load(roonapi, opts)
+    result = None
+    for level, title in enumerate(path, 1):
+        item = _find_item(items, title)
+        if not item:
+            return None
+        result = roonapi.browse_browse(dict(opts, item_key=item["item_key"]))
+        if level < len(path):
+            items = _browse_load(roonapi, opts)
+    if not result or "list" not in result:
+        return None
+    return result["list"]["count"]
+
+
+def _play_action(roonapi, opts, items, action):
+    '''
+        Execute the play action from the current list of a browse session, returns True if found.
+        The action may be a few levels down, e.g. album -> Play Album -> Play Now.
+    '''
+    for _ in range(3):
+        play_item = _find_item(items, action)
+        if play_item:
+            roonapi.browse_browse(dict(opts, item_key=play_item["item_key"]))
+            return True
+        item = next((item for item in items if item.get("hint") == "action_list"), None)
+        if not item:
+            break
+        roonapi.browse_browse(dict(opts, item_key=item["item_key"]))
+        items = _browse_load(roonapi, opts)
+    return False
+
+
+class RoonLibrary(object):
+    """Local index of the Roon library, to find artists, albums, tracks, playlists and stations by name."""
+
+    def __init__(self, hass, roonapi, filename=None, ttl=LIBRARY_TTL):
+        """Initialize the library, without filename there is no index and names are used as given."""
+        self.hass = hass
+        self.roonapi = roonapi
+        self._filename = filename
+        self._ttl = ttl
+        # media type: (number of items reported by roon, [(title, subtitle)])
+        self._lists = {}
+        # media type: (sorted normalized titles, {normalized title: [item index]}, {word: [normalized title]})
+        self._index = {}
+        self._last_refresh = None
+        self._fetch_job = None
+
+    @property
+    def enabled(self):
+        ''' is the index enabled'''
+        return self._filename is not None
+
+    def invalidate(self):
+        ''' check for changes on the next call to async_refresh'''
+        self._last_refresh = None
+
+    def count(self, media_type):
+        ''' number of indexed items of the media type'''
+        return len(self._lists.get(media_type, (0, ()))[1])
+
+    def search(self, media_type, query, limit=10):
+        '''
+            Find items of the media type by name, returns a list of (title, subtitle).
+            Titles starting with the query come first, if there are none the closest matches are returned.
+        '''
+        if media_type not in self._index or not query:
+            return []
+        items = self._lists[media_type][1]
+        names, positions, words = self._index[media_type]
+        query = _normalize(query)
+        matches = []
+        pos = bisect.bisect_left(names, query)
+        while pos < len(names) and names[pos].startswith(query) and len(matches) < limit:
+            matches.append(names[pos])
+            pos += 1
+        if not matches:
+            matches = difflib.get_close_matches(query, self._candidates(words, query), limit, LIBRARY_MATCH_CUTOFF)
+        return [items[index] for name in matches for index in positions[name]][:limit]
+
+    @staticmethod
+    def _candidates(words, query):
+        '''
+            The titles sharing the most (possibly misspelled) words with the query,
+            so the fuzzy match only has to compare a handful of titles instead of the whole library.
+        '''
+        hits = collections.Counter()
+        misspelled = []
+        for word in set(query.split()):
+            if word in words:
+                hits.update(words[word])
+            else:
+                misspelled.append(word)
+        if not hits:
+            # none of the words is known, look for similar words (the vocabulary is much smaller than the library)
+            for word in misspelled:
+                for match in difflib.get_close_matches(word, words, 3, 0.75):
+                    hits.update(words[match])
+        return [name for name, _ in hits.most_common(LIBRARY_MATCH_CANDIDATES)]
+
+    def resolve(self, media_type, query):
+        ''' the (title, subtitle) of the best match for the query, None if there is no match'''
+        matches = self.search(media_type, query, 1)
+        return matches[0] if matches else None
+
+    def resolve_title(self, media_type, query):
+        ''' the title of the only match for the query, None if there is no match or more than one'''
+        titles = set(title for title, _ in self.search(media_type, query, 2))
+        return titles.pop() if len(titles) == 1 else None
+
+    @asyncio.coroutine
+    def async_load(self):
+        ''' load the index of the previous run'''
+        if not self.enabled:
+            return
+        try:
+            data = yield from self.hass.loop.run_in_executor(None, self._read)
+        except (OSError, ValueError) as exc:
+            _LOGGER.error("Unable to load the Roon library index from %s: %s", self._filename, exc)
+            return
+        if not data or data.get("version") != LIBRARY_VERSION:
+            return
+        self._set_lists({media_type: (count, [tuple(item) for item in items])
+                for media_type, (count, items) in data["lists"].items()})
+
+    @asyncio.coroutine
+    def async_refresh(self, force=False):
+        ''' update the index if it is expired, returns True if the content changed'''
+        if not self.enabled:
+            return False
+        if not force and self._last_refresh and time.monotonic() - self._last_refresh < self._ttl:
+            return False
+        # browsing is blocking, run it in the executor and share a running fetch
+        fetch_job = self._fetch_job
+        if fetch_job is None:
+            fetch_job = self._fetch_job = self.hass.loop.run_in_executor(None, self._fetch, force)
+        try:
+            lists = yield from fetch_job
+        except Exception as exc:
+            _LOGGER.error("Unable to index the Roon library: %s", exc)
+            return False
+        finally:
+            self._fetch_job = None
+        self._last_refresh = time.monotonic()
+        if not lists:
+            return False
+        lists = dict(self._lists, **lists)
+        self._set_lists(lists)
+        _LOGGER.debug("library index updated: %s", {media_type: len(lists[media_type][1]) for media_type in lists})
+        try:
+            yield from self.hass.loop.run_in_executor(None, self._write,
+                    {"version": LIBRARY_VERSION, "lists": self._lists})
+        except (OSError, TypeError, ValueError) as exc:
+            _LOGGER.error("Unable to save the Roon library index to %s: %s", self._filename, exc)
+        return True
+
+    def _set_lists(self, lists):
+        ''' replace the lists and rebuild the search index'''
+        index = {}
+        for media_type, (_, items) in lists.items():
+            positions = {}
+            for pos, (title, _) in enumerate(items):
+                positions.setdefault(_normalize(title), []).append(pos)
+            words = {}
+            for name in positions:
+                for word in set(name.split()):
+                    words.setdefault(word, []).append(name)
+            index[media_type] = (sorted(positions), positions, words)
+        # swap both at once, searches run in other threads
+        self._lists, self._index = lists, index
+
+    def _fetch(self, force=False):
+        '''
+            Fetch the lists which changed since the last refresh (runs in the executor).
+            A list is only loaded again when roon reports a different number of items.
+        '''
+        lists = {}
+        opts = {"hierarchy": "browse", "multi_session_key": LIBRARY_SESSION}
+        for media_type, path in LIBRARY_LISTS:
+            count = _browse_open(self.roonapi, opts, path)
+            if count is None:
+                continue
+            if not force and media_type in self._lists and self._lists[media_type][0] == count:
+                continue
+            items = []
+            for offset in range(0, count, LIBRARY_PAGE_SIZE):
+                items += [(_intern(item["title"]), _intern(item.get("subtitle") or ""))
+                        for item in _browse_load(self.roonapi, opts, offset)]
+            lists[media_type] = (count, items)
+        return lists
+
+    def play(self, zone_or_output_id, media_type, title, subtitle=None, shuffle=False):
+        '''
+            Play an artist, album or track, found through the search hierarchy (runs in the dispatcher).
+            Returns True if roon accepted the play action.
+        '''
+        opts = {"hierarchy": "search", "multi_session_key": "hass_%s" % zone_or_output_id,
+                "zone_or_output_id": zone_or_output_id}
+        self.roonapi.browse_browse(dict(opts, pop_all=True, input=title))
+        items = _browse_load(self.roonapi, opts)
+        category = _find_item(items, SEARCH_CATEGORIES[media_type])
+        if category:
+            self.roonapi.browse_browse(dict(opts, item_key=category["item_key"]))
+            items = _browse_load(self.roonapi, opts)
+        item = _find_item(items, title, subtitle) or _find_item(items, title)
+        if not item:
+            _LOGGER.warning("Unable to find %s %s in Roon", media_type, title)
+            return False
+        self.roonapi.browse_browse(dict(opts, item_key=item["item_key"]))
+        action = "Shuffle" if shuffle else "Play Now"
+        if _play_action(self.roonapi, opts, _browse_load(self.roonapi, opts), action):
+            return True
+        _LOGGER.warning("Unable to play %s %s, no %s action", media_type, title, action)
+        return False
+
+    def _read(self):
+        ''' read the index file (runs in the executor)'''
+        if not os.path.isfile(self._filename):
+            return None
+        with open(self._filename) as f:
+            return json.load(f)
+
+    def _write(self, data):
+        ''' write the index file (runs in the executor)'''
+        with open(self._filename + ".tmp", "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(self._filename + ".tmp", self._filename)
+
+
+# a browse item as reported by roon, hint is list, action_list, action or header
+RoonBrowseItem = collections.namedtuple("RoonBrowseItem", ["item_key", "title", "subtitle", "image_key", "hint"])
+# one page of a browse list, item_key is None for the root
+RoonBrowsePage = collections.namedtuple("RoonBrowsePage", ["item_key", "title", "count", "offset", "items"])
+
+
+class RoonBrowser(object):
+    """
+        Pages of the Roon browse hierarchy for the media browser of all players.
+        Only the requested page of a list is loaded, pages are kept in an LRU cache by item key and offset.
+    """
+
+    def __init__(self, hass, roonapi, metrics, max_pages=BROWSE_CACHE_SIZE, ttl=BROWSE_TTL):
+        """Initialize the browser."""
+        self.hass = hass
+        self.roonapi = roonapi
+        self._metrics = metrics
+        self._max_pages = max_pages
+        self._ttl = ttl
+        # (item key, offset): (time loaded, page)
+        self._pages = collections.OrderedDict()
+        self._fetch_jobs = {}
+        # one browse session for all players, so the requests on it are serialized
+        self._lock = threading.Lock()
+        # item key and list info of the list the session is at, a next page of it needs no browse request
+        self._current = None
+        self._list = None
+
+    def invalidate(self):
+        ''' drop all cached pages'''
+        self._pages.clear()
+        self._list = None
+
+    @asyncio.coroutine
+    def async_browse(self, item_key=None, offset=0):
+        ''' the page at offset of the list behind item_key (the root if None), None if roon doesn't know the item'''
+        key = (item_key, offset)
+        cached = self._pages.get(key)
+        if cached and time.monotonic() - cached[0] < self._ttl:
+            self._pages.move_to_end(key)
+            self._metrics.increment("browse_cache_hits")
+            return cached[1]
+        # browsing is blocking, run it in the executor and share a running fetch of the same page
+        fetch_job = self._fetch_jobs.get(key)
+        if fetch_job is None:
+            fetch_job = self._fetch_jobs[key] = self.hass.loop.run_in_executor(None, self._fetch, item_key, offset)
+        start = time.monotonic()
+        try:
+            page = yield from fetch_job
+        except Exception as exc:
+            _LOGGER.error("Unable to browse Roon: %s", exc)
+            return None
+        finally:
+            self._fetch_jobs.pop(key, None)
+        self._metrics.observe("browse_fetch", time.monotonic() - start)
+        if page is None:
+            # the session was reset, the item keys of the cached pages are no longer valid either
+            self.invalidate()
+            return None
+        self._pages[key] = (time.monotonic(), page)
+        while len(self._pages) > self._max_pages:
+            self._pages.popitem(last=False)
+        return page
+
+    def _fetch(self, item_key, offset):
+        ''' open the list if the session isn't at it yet and load one page (runs in the executor)'''
+        opts = {"hierarchy": "browse", "multi_session_key": BROWSE_SESSION}
+        with self._lock:
+            if self._list is None or self._current != item_key:
+                if item_key is None:
+                    result = self.roonapi.browse_browse(dict(opts, pop_all=True))
+                else:
+                    result = self.roonapi.browse_browse(dict(opts, item_key=item_key))
+                self._list = None
+                if not result or result.get("action") != "list" or "list" not in result:
+                    return None
+                self._current, self._list = item_key, result["list"]
+            items = _browse_load(self.roonapi, opts, offset, BROWSE_PAGE_SIZE)
+            title, count = self._list.get("title"), self._list.get("count", 0)
+        return RoonBrowsePage(item_key, title, count, offset, tuple(
+                RoonBrowseItem(item["item_key"], item["title"], item.get("subtitle"), item.get("image_key"),
+                        item.get("hint")) for item in items))
+
+    def play(self, zone_or_output_id, item_key, action="Play Now"):
+        '''
+            Play a browsed item on a zone (runs in the dispatcher), returns True if roon accepted it.
+            Lists like albums are played with their play action, actions are executed right away.
+        '''
+        opts = {"hierarchy": "browse", "multi_session_key": BROWSE_SESSION, "zone_or_output_id": zone_or_output_id}
+        with self._lock:
+            # the session moves away from the current list
+            self._list = None
+            result = self.roonapi.browse_browse(dict(opts, item_key=item_key))
+            if not result:
+                return False
+            if result.get("action") != "list":
+                # an action, roon executed it
+                return True
+            return _play_action(self.roonapi, opts, _browse_load(self.roonapi, opts), action)
+
+
+class RoonCommandDispatcher(object):
+    """Runs roonapi commands on a bounded worker pool, in order per zone."""
+
+    def __init__(self, server, max_workers=COMMAND_WORKERS):
+        """Initialize the dispatcher."""
+        self._server = server
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, method, *args, **kwargs):
+        '''
+            Queue a command, returns a concurrent Future with the result.
+            The method is the name of a roonapi method or a callable. Commands with the
+            same key (zone or output id) run in order, different keys run in parallel.
+        '''
+        job = Future()
+        command = (job, method, args, kwargs, time.monotonic())
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                # a worker is already busy with this key, it will pick up the command
+                queue.append(command)
+                return job
+            self._queues[key] = collections.deque([command])
+        self._executor.submit(self._run_queue, key)
+        return job
+
+    def shutdown(self):
+        ''' stop the worker pool, pending commands are dropped'''
+        self._executor.shutdown(wait=False)
+
+    def _run_queue(self, key):
+        ''' execute all queued commands for the given key (runs in a worker thread)'''
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                job, method, args, kwargs, queued = queue.popleft()
+            if isinstance(method, str):
+                name = method
+                func = getattr(self._server.roonapi, method)
+            else:
+                name = getattr(method, "__name__", str(method))
+                func = method
+            if not job.set_running_or_notify_cancel():
+                continue
+            try:
+                job.set_result(func(*args, **kwargs))
+            except Exception as exc:
+                _LOGGER.error("roon command %s failed for %s: %s", name, key, exc)
+                self._server.metrics.increment("command_errors")
+                job.set_exception(exc)
+            # completion latency, including the time spent in the queue
+            latency = time.monotonic() - queued
+            self._server.metrics.observe("command_%s" % name, latency)
+            _LOGGER.debug("roon command %s completed in %.3f seconds", name, latency)
+
+
+class RoonVolumeSync(object):
+    """Latest-wins coalescing of volume changes between hass and Roon."""
+
+    def __init__(self, dispatcher, interval=VOLUME_RATE_LIMIT, settle_time=VOLUME_SETTLE_TIME):
+        """Initialize the volume sync."""
+        self._dispatcher = dispatcher
+        self._interval = interval
+        self._settle_time = settle_time
+        self._pending = {}
+        self._last_sent = {}
+        self._written = {}
+        self._lock = threading.Lock()
+
+    def set_volume(self, key, value, send, queue_key=None):
+        '''
+            Queue a volume change for key (output id or entity id), send is called with the value.
+            While a change is pending for the key only the latest value is kept and at most
+            one change per interval is sent.
+        '''
+        with self._lock:
+            scheduled = key in self._pending
+            self._pending[key] = (value, send)
+            if scheduled:
+                return
+            wait = self._interval - (time.monotonic() - self._last_sent.get(key, 0))
+        if wait > 0:
+            # rate limit, more changes can come in and replace the pending value meanwhile,
+            # the dispatcher worker is not held up while waiting
+            timer = threading.Timer(wait, self._dispatcher.submit, (queue_key or key, self.send_volume, key))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._dispatcher.submit(queue_key or key, self.send_volume, key)
+
+    def send_volume(self, key):
+        ''' send the latest pending value for the key (runs in the dispatcher)'''
+        with self._lock:
+            value, send = self._pending.pop(key)
+            self._last_sent[key] = time.monotonic()
+        send(value)
+
+    def is_settling(self, key):
+        ''' True while a change for the key is pending or was sent within the settle time'''
+        with self._lock:
+            if key in self._pending:
+                return True
+            last_sent = self._last_sent.get(key)
+        return last_sent is not None and time.monotonic() - last_sent < self._settle_time
+
+    def settle_remaining(self, key):
+        ''' seconds until the changes for the key settled, 0 if it isn't settling'''
+        with self._lock:
+            if key in self._pending:
+                # the pending change is sent within the interval, then it has to settle
+                return self._interval + self._settle_time
+            last_sent = self._last_sent.get(key)
+        if last_sent is None:
+            return 0
+        return max(self._settle_time - (time.monotonic() - last_sent), 0)
+
+    def mark_written(self, key, value):
+        ''' remember a value we wrote to hass ourselves'''
+        self._written[key] = (value, time.monotonic())
 
+    def is_echo(self, key, value):
+        ''' True if the value is the echo of a value we wrote within the settle time'''
+        written = self._written.get(key)
+        return (written is not None and written[0] == value and
+                time.monotonic() - written[1] < self._settle_time)
+
+
+class RoonArtworkCache(object):
+    """Size bounded LRU cache of resized artwork on disk."""
+
+    def __init__(self, hass, server, directory, max_bytes, size=ARTWORK_SIZE):
+        """Initialize the artwork cache."""
+        self.hass = hass
+        self._server = server
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._size = size
+        self._files = collections.OrderedDict()
+        self._total_bytes = 0
+        self._fetch_jobs = {}
+        self._index_job = None
+
+    def prefetch(self, image_key):
+        ''' fetch the image in the background so it is cached when the frontend asks for it'''
+        if image_key and self._filename(image_key) not in self._files and image_key not in self._fetch_jobs:
+            self._fetch(image_key)
+
+    @asyncio.coroutine
+    def async_get(self, image_key):
+        ''' return (content, content_type) of the image, fetched from roon if not cached'''
+        yield from self._async_load_index()
+        filename = self._filename(image_key)
+        content = None
+        if filename in self._files:
+            self._files.move_to_end(filename)
+            content = yield from self.hass.loop.run_in_executor(None, self._read, filename)
+        if content is None:
+            content = yield from self._fetch(image_key)
+        if not content:
+            return None, None
+        return content, "image/jpeg"
+
+    def _filename(self, image_key):
+        ''' file name of the resized variant of an image'''
+        return "%s_%s.jpg" % (hashlib.md5(image_key.encode("utf-8")).hexdigest(), self._size)
+
+    def _fetch(self, image_key):
+        ''' start (or join) the download of an image, returns the job'''
+        job = self._fetch_jobs.get(image_key)
+        if job is None:
+            job = self._fetch_jobs[image_key] = ensure_future(self._async_download(image_key), loop=self.hass.loop)
+        return job
+
+    @asyncio.coroutine
+    def _async_download(self, image_key):
+        ''' download the resized image from roon and store it in the cache'''
+        try:
+            yield from self._async_load_index()
+            url = self._server.roonapi.get_image(image_key, width=self._size, height=self._size)
+            session = async_get_clientsession(self.hass)
+            with async_timeout.timeout(TIMEOUT, loop=self.hass.loop):
+                response = yield from session.get(url)
+                content = yield from response.read()
+            if response.status != 200:
+                _LOGGER.warning("Unable to fetch artwork %s: HTTP %s", image_key, response.status)
+                return None
+            filename = self._filename(image_key)
+            yield from self.hass.loop.run_in_executor(None, self._write, filename, content)
+            self._add(filename, len(content))
+            return content
+        except (asyncio.TimeoutError, aiohttp.ClientError, OSError) as exc:
+            _LOGGER.warning("Unable to fetch artwork %s: %s", image_key, exc)
+            return None
+        finally:
+            self._fetch_jobs.pop(image_key, None)
+
+    def _add(self, filename, size):
+        ''' add a file to the index and evict the least recently used files when over size'''
+        self._total_bytes += size - self._files.pop(filename, 0)
+        self._files[filename] = size
+        evicted = []
+        while self._total_bytes > self._max_bytes and len(self._files) > 1:
+            old_filename, old_size = self._files.popitem(last=False)
+            self._total_bytes -= old_size
+            evicted.append(old_filename)
+        if evicted:
+            self.hass.loop.run_in_executor(None, self._remove, evicted)
+
+    @asyncio.coroutine
+    def _async_load_index(self):
+        ''' wait until the index of the cached files is loaded'''
+        if self._index_job is None:
+            self._index_job = ensure_future(self._async_scan(), loop=self.hass.loop)
+        yield from self._index_job
+
+    @asyncio.coroutine
+    def _async_scan(self):
+        ''' load the index of the cached files (in the executor)'''
+        try:
+            files = yield from self.hass.loop.run_in_executor(None, self._scan)
+        except OSError as exc:
+            _LOGGER.error("Unable to read artwork cache %s: %s", self._directory, exc)
+            return
+        for filename, size in files:
+            self._files[filename] = size
+            self._total_bytes += size
+
+    def _scan(self):
+        ''' list the cached files, least recently used first (runs in the executor)'''
+        os.makedirs(self._directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self._directory):
+            if entry.is_file() and entry.name.endswith(".jpg"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        return [(filename, size) for _, filename, size in sorted(files)]
+
+    def _read(self, filename):
+        ''' read a cached file (runs in the executor)'''
+        try:
+            path = os.path.join(self._directory, filename)
+            with open(path, "rb") as f:
+                content = f.read()
+            # mtime keeps the lru order across restarts
+            os.utime(path)
+            return content
+        except OSError:
+            return None
+
+    def _write(self, filename, content):
+        ''' write a file to the cache (runs in the executor)'''
+        path = os.path.join(self._directory, filename)
+        with open(path + ".tmp", "wb") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+
+    def _remove(self, filenames):
+        ''' remove evicted files (runs in the executor)'''
+        for filename in filenames:
+            try:
+                os.remove(os.path.join(self._directory, filename))
+            except OSError:
+                pass
+
+
+class RoonTraceRecorder(object):
+    """
+        Appends every roonapi state callback to a trace file, for replay with roon_bench.py.
+        One compact json object per line: t (timestamp), e (event), ids and s (snapshot of the changed items).
+        The first line is a snapshot of all zones.
+    """
+
+    def __init__(self, filename):
+        """Initialize the recorder, the file is opened on the first event."""
+        self._filename = filename
+        self._file = None
+        self._lock = threading.Lock()
+
+    def record(self, event, changed_ids, zones, outputs):
+        ''' append an event (runs in the roonapi thread)'''
+        changed_ids = list(changed_ids)
+        if event == "zones_seek_changed":
+            # seek events are frequent, only keep the position
+            snapshot = {zone_id: zones[zone_id].get("seek_position") for zone_id in changed_ids if zone_id in zones}
+        elif event == "outputs_changed":
+            snapshot = {output_id: outputs.get(output_id) for output_id in changed_ids}
+        else:
+            snapshot = {zone_id: zones.get(zone_id) for zone_id in changed_ids}
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self._filename, "a")
+                    self._write("snapshot", list(zones.keys()), dict(zones))
+                self._write(event, changed_ids, snapshot)
+            except (OSError, TypeError, ValueError) as exc:
+                _LOGGER.error("Unable to record Roon event to %s: %s", self._filename, exc)
+
+    def close(self):
+        ''' close the trace file'''
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _write(self, event, changed_ids, snapshot):
+        ''' write one line'''
+        self._file.write(json.dumps({"t": round(time.time(), 3), "e": event, "ids": changed_ids, "s": snapshot},
+                separators=(",", ":")) + "\n")
+
+
+class RoonMetrics(object):
+    """Counters and latency histograms of the hot paths, cheap to update from any thread."""
+
+    def __init__(self, samples=METRICS_SAMPLES):
+        """Initialize the metrics."""
+        self._samples = samples
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._histograms = {}
+
+    def increment(self, name, value=1):
+        ''' increment a counter'''
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name, value):
+        ''' add a value (seconds for latencies) to a histogram'''
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {"count": 0, "sum": 0, "max": 0,
+                        "recent": collections.deque(maxlen=self._samples)}
+            histogram["count"] += 1
+            histogram["sum"] += value
+            histogram["max"] = max(histogram["max"], value)
+            histogram["recent"].append(value)
+
+    def snapshot(self):
+        '''
+            Flat dict of all metrics, usable as state attributes.
+            Percentiles are calculated over the most recent samples, latencies are in ms.
+        '''
+        with self._lock:
+            snapshot = dict(self._counters)
+            histograms = [(name, histogram["count"], histogram["sum"], histogram["max"], sorted(histogram["recent"]))
+                    for name, histogram in self._histograms.items()]
+        for name, count, total, maximum, recent in histograms:
+            # counts (like zones per pass) are reported as is
+            scale = 1 if name.endswith("_per_pass") else 1000
+            snapshot["%s_count" % name] = count
+            snapshot["%s_avg" % name] = round(total / count * scale, 2)
+            snapshot["%s_max" % name] = round(maximum * scale, 2)
+            snapshot["%s_p50" % name] = round(recent[len(recent) // 2] * scale, 2)
+            snapshot["%s_p95" % name] = round(recent[min(len(recent) - 1, len(recent) * 95 // 100)] * scale, 2)
+        return snapshot
+
+
+class RoonProfiler(object):
+    """On-demand profiler for the event loop and the roonapi callback thread."""
+
+    def __init__(self, hass):
+        """Initialize the profiler."""
+        self.hass = hass
+        self._loop_profile = None
+        # one profile per roonapi thread, every core has its own
+        self._thread_profiles = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        ''' True while profiling'''
+        return self._loop_profile is not None
+
+    @callback
+    def start(self, seconds):
+        ''' start profiling (runs in the event loop), stops automatically after the given seconds'''
+        if self.active:
+            _LOGGER.warning("Roon profiler is already running")
+            return
+        _LOGGER.warning("Profiling the Roon integration for %s seconds", seconds)
+        self._thread_profiles = {}
+        self._loop_profile = cProfile.Profile()
+        # enabled from the loop, so this profiles all coroutines and callbacks in the loop thread
+        self._loop_profile.enable()
+        self.hass.loop.call_later(seconds, self._stop)
+
+    def runcall(self, func, *args):
+        ''' call func in a roonapi thread with the profiler of that thread enabled'''
+        # the lock only guards the profiles, the callbacks of the cores don't wait for each other
+        with self._lock:
+            if self._thread_profiles is None:
+                profile = None
+            else:
+                profile = self._thread_profiles.get(threading.get_ident())
+                if profile is None:
+                    profile = self._thread_profiles[threading.get_ident()] = cProfile.Profile()
+        if profile is None:
+            return func(*args)
+        return profile.runcall(func, *args)
+
+    @callback
+    def _stop(self):
+        ''' stop profiling and write the stats to the config directory'''
+        loop_profile = self._loop_profile
+        loop_profile.disable()
+        with self._lock:
+            thread_profiles = list(self._thread_profiles.values())
+            self._thread_profiles = None
+        self._loop_profile = None
+        prefix = self.hass.config.path("roon_profile_%s" % time.strftime("%Y%m%d_%H%M%S"))
+        self.hass.loop.run_in_executor(None, self._write, prefix, loop_profile, thread_profiles)
+
+    @staticmethod
+    def _write(prefix, loop_profile, thread_profiles):
+        ''' write the pstats files (runs in the executor), the profiles of the roonapi threads are merged'''
+        for name, profiles in (("loop", [loop_profile]), ("callbacks", thread_profiles)):
+            if not profiles:
+                # no roon events while profiling
+                continue
+            filename = "%s_%s.pstats" % (prefix, name)
+            try:
+                pstats.Stats(*profiles).dump_stats(filename)
+            except TypeError:
+                # nothing was recorded
+                continue
+            _LOGGER.warning("Roon profile written to %s", filename)
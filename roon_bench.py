@@ -0,0 +1,725 @@
+"""
+Synthetic load benchmark for the Roon component.
+
+Runs RoonServer against an in-process stand-in for roon.RoonApi, so the hot paths
+can be measured without a real Roon core. Needs the same environment as the
+component itself (Home Assistant installed).
+
+Usage:
+    python roon_bench.py --zones 20 --outputs 2 --events 2000 --rate 500 --latency 0.01
+
+A trace recorded with the trace_file option of the component can be replayed instead
+of the synthetic events, at the recorded pace or as fast as possible:
+    python roon_bench.py --replay roon_trace.jsonl [--realtime]
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+COMPONENT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "roon.py")
+
+
+def load_component(path=COMPONENT_FILE):
+    ''' import the component module (roon.py clashes with the roonapi package name)'''
+    spec = importlib.util.spec_from_file_location("roon_component", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values, pct):
+    ''' simple nearest-rank percentile'''
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class FakeRoonApi(object):
+    """In-process stand-in for roon.RoonApi with configurable command latency."""
+
+    def __init__(self, zones=10, outputs_per_zone=1, latency=0.0, playlists=100, stations=50, artists=100):
+        """Initialize the fake api with a generated set of zones."""
+        self.token = "benchmark"
+        self.latency = latency
+        self.zones = {}
+        self.outputs = {}
+        self.command_count = 0
+        self.browse_count = 0
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._playlists = {"items": [{"title": "Playlist %s" % i} for i in range(playlists)]}
+        self._stations = {"items": [{"title": "Station %s" % i} for i in range(stations)]}
+        self._nodes = {}
+        self._sessions = {}
+        self._root = self._build_library(artists)
+        all_output_ids = ["output_%s_%s" % (z, o) for z in range(zones) for o in range(outputs_per_zone)]
+        for z in range(zones):
+            zone_id = "zone_%s" % z
+            outputs = []
+            for o in range(outputs_per_zone):
+                output = {
+                    "output_id": "output_%s_%s" % (z, o),
+                    "zone_id": zone_id,
+                    "display_name": "Zone %s Output %s" % (z, o),
+                    "volume": {"type": "number", "value": 50, "step": 1, "is_muted": False},
+                    "can_group_with_output_ids": all_output_ids,
+                    "source_controls": [],
+                }
+                outputs.append(output)
+                self.outputs[output["output_id"]] = output
+            self.zones[zone_id] = {
+                "zone_id": zone_id,
+                "display_name": "Zone %s" % z,
+                "outputs": outputs,
+                "state": "playing",
+                "settings": {"shuffle": False, "loop": "disabled"},
+                "now_playing": self._now_playing(0),
+            }
+
+    @staticmethod
+    def _now_playing(track):
+        ''' now playing info for a generated track'''
+        return {
+            "seek_position": 0,
+            "length": 300,
+            "image_key": "image_%s" % track,
+            "three_line": {"line1": "Track %s" % track, "line2": "Artist", "line3": "Album"},
+        }
+
+    def load_zones(self, zones):
+        ''' replace all zones (and their outputs) with the given zones'''
+        self.zones = dict(zones)
+        self.outputs = {output["output_id"]: output for zone in self.zones.values() for output in zone["outputs"]}
+
+    def register_state_callback(self, callback, event_filter=None, id_filter=None):
+        ''' register a state callback, like RoonApi'''
+        self._callbacks.append((callback, event_filter))
+
+    def emit(self, event, changed_ids):
+        ''' fire a state event to the registered callbacks (call from a thread, like the websocket)'''
+        for callback, event_filter in self._callbacks:
+            if not event_filter or event in event_filter:
+                callback(event, changed_ids)
+
+    def change_zone(self, zone_id, kind):
+        ''' mutate a zone like the core would, returns the event name to fire'''
+        zone = self.zones[zone_id]
+        if kind == "seek":
+            # like roonapi, a seek event only updates the top level field
+            zone["seek_position"] = zone.get("seek_position", 0) + 1
+            return "zones_seek_changed"
+        # roonapi replaces the zone object on a change, the core sends the position in now_playing only
+        zone = dict(zone)
+        zone.pop("seek_position", None)
+        if kind == "track":
+            zone["now_playing"] = self._now_playing(random.randint(0, 1000))
+        elif kind == "volume":
+            output = dict(random.choice(zone["outputs"]))
+            output["volume"] = dict(output["volume"], value=random.randint(0, 100))
+            zone["outputs"] = [output if o["output_id"] == output["output_id"] else o for o in zone["outputs"]]
+            self.outputs[output["output_id"]] = output
+        else:
+            # an update that doesn't touch anything hass shows, e.g. the queue
+            zone["queue_items_remaining"] = random.randint(0, 100)
+        self.zones[zone_id] = zone
+        return "zones_changed"
+
+    def remove_zone(self, zone_id):
+        ''' remove a zone and its outputs like roonapi does, without firing a callback'''
+        zone = self.zones.pop(zone_id)
+        for output in zone["outputs"]:
+            self.outputs.pop(output["output_id"], None)
+        return len(zone["outputs"])
+
+    def change_output_id(self, zone_id):
+        ''' give the first output of a zone a new id, like the core sometimes does, returns the event name to fire'''
+        zone = dict(self.zones[zone_id])
+        output = zone["outputs"][0]
+        self.outputs.pop(output["output_id"], None)
+        output = dict(output, output_id="%s_new" % output["output_id"])
+        zone["outputs"] = [output] + zone["outputs"][1:]
+        self.outputs[output["output_id"]] = output
+        self.zones[zone_id] = zone
+        return "zones_changed"
+
+    def playlists(self):
+        ''' browse the playlists'''
+        time.sleep(self.latency)
+        return self._playlists
+
+    def internet_radio(self):
+        ''' browse the radio stations'''
+        time.sleep(self.latency)
+        return self._stations
+
+    def _node(self, title, subtitle="", hint="list", children=None):
+        ''' a browse item, items without children are actions'''
+        node = {"title": title, "subtitle": subtitle, "hint": hint, "item_key": str(len(self._nodes)),
+                "children": children}
+        self._nodes[node["item_key"]] = node
+        return node
+
+    def _actions(self, title):
+        ''' the action list to play an item'''
+        return self._node(title, hint="action_list", children=[
+            self._node(action, hint="action") for action in ("Play Now", "Shuffle", "Add Next", "Queue")])
+
+    def _build_library(self, artists):
+        ''' generate a library with 5 albums of 10 tracks per artist'''
+        self.library = {"artist": [], "album": [], "track": []}
+        for a in range(artists):
+            artist = "Artist %s" % a
+            albums = []
+            for b in range(5):
+                album = "Album %s-%s" % (a, b)
+                tracks = [self._node("Track %s-%s-%s" % (a, b, t), artist, "action_list",
+                        self._actions("Play Now")["children"]) for t in range(10)]
+                albums.append(self._node(album, artist, children=[self._actions("Play Album")] + tracks))
+                self.library["track"] += tracks
+            self.library["album"] += albums
+            self.library["artist"].append(self._node(artist, children=[self._actions("Play Artist")] + albums))
+        library = self._node("Library", children=[
+            self._node("Artists", children=self.library["artist"]),
+            self._node("Albums", children=self.library["album"]),
+            self._node("Tracks", children=self.library["track"])])
+        playlists = self._node("Playlists", children=[
+            self._node(item["title"], children=[self._actions("Play Playlist")]) for item in self._playlists["items"]])
+        stations = self._node("Internet Radio", children=[
+            self._node(item["title"], children=[self._actions("Play Radio")]) for item in self._stations["items"]])
+        return [library, playlists, stations]
+
+    def browse_browse(self, opts):
+        ''' browse api: open a list or execute an action'''
+        time.sleep(self.latency)
+        with self._lock:
+            self.browse_count += 1
+        session = opts.get("multi_session_key", "")
+        if opts.get("pop_all"):
+            if opts.get("hierarchy") == "search":
+                query = opts.get("input", "").lower()
+                items = [self._node(category, children=[node for node in self.library[media_type]
+                        if query in node["title"].lower()])
+                        for media_type, category in (("artist", "Artists"), ("album", "Albums"), ("track", "Tracks"))]
+            else:
+                items = self._root
+        else:
+            node = self._nodes[opts["item_key"]]
+            if node["children"] is None:
+                with self._lock:
+                    self.command_count += 1
+                return {"action": "message"}
+            items = node["children"]
+        self._sessions[session] = items
+        return {"action": "list", "list": {"count": len(items)}}
+
+    def browse_load(self, opts):
+        ''' browse api: load a page of the current list'''
+        time.sleep(self.latency)
+        with self._lock:
+            self.browse_count += 1
+        items = self._sessions.get(opts.get("multi_session_key", ""), [])
+        offset = opts.get("offset", 0)
+        page = items[offset:offset + opts.get("count", 100)]
+        return {"items": [{key: node[key] for key in ("title", "subtitle", "hint", "item_key")} for node in page],
+                "list": {"count": len(items)}}
+
+    def get_image(self, image_key, scale="fit", width=500, height=500):
+        ''' url of an image'''
+        return "http://roon.local/api/image/%s?scale=%s&width=%s&height=%s" % (image_key, scale, width, height)
+
+    def _command(self, *args, **kwargs):
+        ''' any command, takes a websocket round-trip'''
+        time.sleep(self.latency)
+        with self._lock:
+            self.command_count += 1
+        return True
+
+    playback_control = seek = change_volume = mute = shuffle = _command
+    convenience_switch = standby = group_outputs = ungroup_outputs = _command
+    play_playlist = play_radio = queue_playlist = play_genre = _command
+
+    def stop(self):
+        ''' stop the connection'''
+
+
+class TraceReplay(object):
+    """Feeds a recorded trace into a FakeRoonApi."""
+
+    def __init__(self, api, filename):
+        """Load the trace and apply its initial snapshot."""
+        self.api = api
+        with open(filename) as f:
+            self.entries = [json.loads(line) for line in f if line.strip()]
+        if self.entries and self.entries[0]["e"] == "snapshot":
+            self.api.load_zones(self.entries.pop(0)["s"])
+
+    def apply(self, entry):
+        ''' apply the snapshot of an entry to the api, like roonapi does before firing the callback'''
+        event, snapshot = entry["e"], entry["s"]
+        if event == "zones_seek_changed":
+            for zone_id, seek_position in snapshot.items():
+                zone = self.api.zones.get(zone_id)
+                if zone:
+                    zone["seek_position"] = seek_position
+        elif event == "outputs_changed":
+            for output_id, output in snapshot.items():
+                if output is None:
+                    self.api.outputs.pop(output_id, None)
+                else:
+                    self.api.outputs[output_id] = output
+        elif event == "snapshot":
+            self.api.load_zones(snapshot)
+        else:
+            for zone_id, zone in snapshot.items():
+                if zone is None:
+                    self.api.zones.pop(zone_id, None)
+                else:
+                    self.api.zones[zone_id] = zone
+                    for output in zone["outputs"]:
+                        self.api.outputs[output["output_id"]] = output
+        return event, entry["ids"]
+
+
+class FakeState(object):
+    """Minimal hass state object."""
+
+    def __init__(self, state, attributes=None):
+        """Initialize the state."""
+        self.state = state
+        self.attributes = attributes or {}
+
+
+class FakeStates(object):
+    """Minimal hass state machine."""
+
+    def __init__(self):
+        """Initialize with the widget entities the component uses."""
+        self._states = {
+            "input_select.roon_playlists": FakeState("Select playlist"),
+            "input_select.roon_players": FakeState("Select room"),
+            "input_number.roon_volume": FakeState("0"),
+        }
+        self.writes = 0
+
+    def get(self, entity_id):
+        ''' return a state'''
+        return self._states.get(entity_id)
+
+    def async_set(self, entity_id, state, attributes=None):
+        ''' set a state'''
+        self.writes += 1
+        self._states[entity_id] = FakeState(state, attributes)
+
+
+class FakeServices(object):
+    """Records service calls instead of executing them."""
+
+    def __init__(self):
+        """Initialize the service registry."""
+        self.calls = 0
+
+    @asyncio.coroutine
+    def async_call(self, domain, service, data=None, blocking=False):
+        ''' record a service call'''
+        self.calls += 1
+
+    def call(self, domain, service, data=None, blocking=False):
+        ''' record a service call'''
+        self.calls += 1
+
+    def async_register(self, domain, service, handler, schema=None):
+        ''' services are not used in the benchmark'''
+
+
+class FakeBus(object):
+    """Event bus that ignores listeners and keeps the fired events."""
+
+    def __init__(self):
+        """Initialize the bus."""
+        self.events = []
+
+    def async_listen(self, event_type, listener):
+        ''' register a listener, returns the remove function'''
+        return lambda: None
+
+    async_listen_once = async_listen
+
+    def async_fire(self, event_type, event_data=None):
+        ''' fire an event'''
+        self.events.append((event_type, event_data))
+
+
+class FakeConfig(object):
+    """Hass config pointing at a temporary directory."""
+
+    def __init__(self):
+        """Initialize the config directory."""
+        self.config_dir = tempfile.mkdtemp(prefix="roon_bench_")
+
+    def path(self, *parts):
+        ''' path in the config directory'''
+        return os.path.join(self.config_dir, *parts)
+
+
+class FakeHass(object):
+    """Just enough of HomeAssistant to run RoonServer."""
+
+    def __init__(self, loop):
+        """Initialize the fake hass."""
+        self.loop = loop
+        self.states = FakeStates()
+        self.services = FakeServices()
+        self.bus = FakeBus()
+        self.config = FakeConfig()
+        self.data = {}
+
+
+class Benchmark(object):
+    """Drives RoonServer with synthetic load and collects the numbers."""
+
+    def __init__(self, component, args):
+        """Initialize the benchmark."""
+        self.args = args
+        self.component = component
+        self.loop = asyncio.get_event_loop()
+        self.hass = FakeHass(self.loop)
+        self.replay = None
+        if args.replay:
+            self.api = FakeRoonApi(0, 0, args.latency, artists=args.artists)
+            self.replay = TraceReplay(self.api, args.replay)
+        else:
+            self.api = FakeRoonApi(args.zones, args.outputs, args.latency, artists=args.artists)
+        self.server = component.RoonServer(self.hass, self.api, self.add_devices, None, [], [],
+                update_window=args.window, trace_file=args.record,
+                library_file=self.hass.config.path(component.LIBRARY_FILE))
+        self.devices = []
+        self.events = 0
+        self.writes = 0
+        self.latencies = []
+        self._event_times = {}
+
+    def add_devices(self, devices, update=False):
+        ''' add_devices callback: register the devices like hass would'''
+        for device in devices:
+            device.hass = self.hass
+            device.entity_id = "media_player.%s" % device.unique_id
+            self.server.register_entity(device.entity_id, device.unique_id)
+            self.server.add_update_callback(self.state_write, device.unique_id)
+            self.devices.append(device)
+
+    def state_write(self, dev_id):
+        ''' update callback of a device, this is where hass would write the state'''
+        self.writes += 1
+        device = self.server.devices[dev_id]
+        event_time = self._event_times.pop(device.zone_id, None)
+        if event_time is not None:
+            self.latencies.append(time.monotonic() - event_time)
+
+    def fire_events(self, count, rate):
+        ''' emit zone events from a thread, like the roonapi websocket thread'''
+        zone_ids = list(self.api.zones.keys())
+        kinds = ["seek"] * 6 + ["track", "volume", "other", "other"]
+        interval = 1.0 / rate if rate else 0
+        for _ in range(count):
+            zone_id = random.choice(zone_ids)
+            event = self.api.change_zone(zone_id, random.choice(kinds))
+            self._event_times.setdefault(zone_id, time.monotonic())
+            self.events += 1
+            self.api.emit(event, [zone_id])
+            if interval:
+                time.sleep(interval)
+
+    def replay_events(self, realtime):
+        ''' emit the events of the trace from a thread, at the recorded pace if realtime'''
+        start = time.monotonic()
+        first = self.replay.entries[0]["t"] if self.replay.entries else 0
+        for entry in self.replay.entries:
+            if realtime:
+                delay = entry["t"] - first - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            event, changed_ids = self.replay.apply(entry)
+            if event in ("zones_changed", "zones_seek_changed"):
+                for zone_id in changed_ids:
+                    self._event_times.setdefault(zone_id, time.monotonic())
+            self.events += 1
+            if event != "snapshot":
+                self.api.emit(event, changed_ids)
+
+    @asyncio.coroutine
+    def run_events(self):
+        ''' event -> state write part'''
+        # initial population of the players
+        yield from self.server.update_changed_players(list(self.api.zones.keys()))
+        self.writes = 0
+        if self.replay:
+            thread = threading.Thread(target=self.replay_events, args=(self.args.realtime,))
+        else:
+            thread = threading.Thread(target=self.fire_events, args=(self.args.events, self.args.rate))
+        start = time.monotonic()
+        thread.start()
+        while thread.is_alive():
+            yield from asyncio.sleep(0.05)
+        # let the last window drain
+        yield from asyncio.sleep(self.server._update_window * 2 + 0.5)
+        return time.monotonic() - start
+
+    @asyncio.coroutine
+    def run_playlists(self):
+        ''' playlist refresh part'''
+        durations = []
+        for _ in range(self.args.playlist_passes):
+            self.server.catalog.invalidate()
+            start = time.monotonic()
+            yield from self.server.update_playlists()
+            durations.append(time.monotonic() - start)
+        return durations
+
+    @asyncio.coroutine
+    def run_library(self):
+        ''' library part: build the index, refresh it and look up names like play_media does'''
+        library = self.server.library
+        before = self.api.browse_count
+        start = time.monotonic()
+        yield from library.async_refresh(force=True)
+        index_time = time.monotonic() - start
+        index_requests = self.api.browse_count - before
+        before = self.api.browse_count
+        start = time.monotonic()
+        library.invalidate()
+        yield from library.async_refresh()
+        refresh_time = time.monotonic() - start
+        refresh_requests = self.api.browse_count - before
+        # exact names, prefixes and misspelled names
+        tracks = self.api.library["track"]
+        queries = []
+        for i in range(300):
+            title = random.choice(tracks)["title"]
+            queries.append([title, title[:-2], title.replace("Track", "Trak")][i % 3])
+        lookups = []
+        for query in queries:
+            start = time.monotonic()
+            library.resolve("track", query)
+            lookups.append(time.monotonic() - start)
+        # the remaining browse walk to start playback of a resolved track
+        title, subtitle = library.resolve("track", queries[0])
+        start = time.monotonic()
+        yield from asyncio.wrap_future(self.server.dispatcher.submit(
+                "library", library.play, self.devices[0].zone_id, "track", title, subtitle))
+        play_time = time.monotonic() - start
+        return (sum(library.count(media_type) for media_type, _ in self.component.LIBRARY_LISTS), index_time,
+                index_requests, refresh_time, refresh_requests, lookups, play_time)
+
+    @asyncio.coroutine
+    def run_browse(self):
+        '''
+            media browser part: open Library -> Albums and its next page through the media browser of a player,
+            navigate back and play an album
+        '''
+        if not self.component.SUPPORT_BROWSE_MEDIA:
+            # Home Assistant older than 0.115
+            return None
+        device = self.devices[0]
+        media_type = self.component.MEDIA_TYPE_LIBRARY
+
+        def child_id(parent, title):
+            return next(child.media_content_id for child in parent.children if child.title == title)
+
+        before = self.api.browse_count
+        start = time.monotonic()
+        root = yield from device.async_browse_media()
+        library = yield from device.async_browse_media(media_type, child_id(root, "Library"))
+        albums = yield from device.async_browse_media(media_type, child_id(library, "Albums"))
+        # the last child links to the next page
+        yield from device.async_browse_media(media_type, albums.children[-1].media_content_id)
+        open_time = time.monotonic() - start
+        open_requests = self.api.browse_count - before
+        # back to the root, all levels are cached
+        before = self.api.browse_count
+        start = time.monotonic()
+        yield from device.async_browse_media(media_type, albums.media_content_id)
+        yield from device.async_browse_media(media_type, library.media_content_id)
+        yield from device.async_browse_media()
+        back_time = time.monotonic() - start
+        back_requests = self.api.browse_count - before
+        # the number of albums, from the cached page
+        page = yield from self.server.browser.async_browse(albums.media_content_id)
+        start = time.monotonic()
+        yield from asyncio.wrap_future(self.server.dispatcher.submit(
+                "browse", self.server.browser.play, device.zone_id, albums.children[0].media_content_id))
+        play_time = time.monotonic() - start
+        return page.count, open_time, open_requests, back_time, back_requests, play_time
+
+    def run_commands(self):
+        ''' command throughput part, calls the RoonDevice command methods'''
+        before = self.api.command_count
+        start = time.monotonic()
+        for i in range(self.args.commands):
+            device = self.devices[i % len(self.devices)]
+            command = i % 4
+            if command == 0:
+                device.media_pause()
+            elif command == 1:
+                device.media_play()
+            elif command == 2:
+                device.media_seek(i % 300)
+            else:
+                device.volume_up()
+        while self.api.command_count - before < self.args.commands:
+            time.sleep(0.001)
+        elapsed = time.monotonic() - start
+        # volume drag: every step is requested, only the latest values should be sent
+        before = self.api.command_count
+        for step in range(100):
+            self.devices[0].set_volume_level(step / 100)
+        time.sleep(1)
+        return elapsed, self.api.command_count - before
+
+    @asyncio.coroutine
+    def run_scene(self):
+        ''' whole-house scene part: pause and group all players with one service call each'''
+        entity_ids = [device.entity_id for device in self.devices]
+        before = self.api.command_count
+        start = time.monotonic()
+        yield from self.server.async_multi_command(entity_ids, "pause")
+        yield from self.server.async_multi_command(entity_ids, "volume_set", 0.3)
+        yield from self.server.async_join(entity_ids[0], entity_ids[1:])
+        return time.monotonic() - start, self.api.command_count - before
+
+    @asyncio.coroutine
+    def run_resync(self):
+        ''' resync part: a few zones changed while the connection was down, resync with the fresh snapshot'''
+        zone_ids = list(self.api.zones.keys())
+        changed = random.sample(zone_ids, min(3, len(zone_ids)))
+        for zone_id in changed:
+            self.api.change_zone(zone_id, "track")
+        writes = self.writes
+        before = self.api.browse_count
+        start = time.monotonic()
+        yield from self.server.async_resync()
+        # the state writes are flushed in the next loop iteration
+        yield from asyncio.sleep(0)
+        elapsed = time.monotonic() - start
+        return len(zone_ids), len(changed), self.writes - writes, self.api.browse_count - before, elapsed
+
+    @asyncio.coroutine
+    def run_removal(self):
+        ''' removal part: a zone disappears silently, the next event of another zone marks its players offline'''
+        zone_ids = list(self.api.zones.keys())
+        if len(zone_ids) < 2:
+            return 0, 0, 0
+        removed = self.api.remove_zone(zone_ids[0])
+        offline = len(self.server.offline_devices)
+        start = time.monotonic()
+        self.api.emit(self.api.change_zone(zone_ids[1], "track"), [zone_ids[1]])
+        while len(self.server.offline_devices) - offline < removed and time.monotonic() - start < 5:
+            yield from asyncio.sleep(0.01)
+        return removed, len(self.server.offline_devices) - offline, time.monotonic() - start
+
+    @asyncio.coroutine
+    def run_output_id_change(self):
+        ''' output id part: roon gives an output a new id, its player must stay available over the next drains'''
+        zone_ids = list(self.api.zones.keys())
+        if len(zone_ids) < 2:
+            return True
+        zone_id = zone_ids[-1]
+        self.api.emit(self.api.change_output_id(zone_id), [zone_id])
+        dev_id = self.server.get_dev_id(self.api.zones[zone_id]["outputs"][0])
+        for _ in range(3):
+            # a few more drains, each one diffs the known outputs against the live ones
+            yield from asyncio.sleep(self.server._update_window * 2 + 0.1)
+            self.api.emit(self.api.change_zone(zone_ids[-2], "track"), [zone_ids[-2]])
+        yield from asyncio.sleep(self.server._update_window * 2 + 0.1)
+        return dev_id not in self.server.offline_devices
+
+    def run(self):
+        ''' run all parts and print the report'''
+        tracemalloc.start()
+        elapsed = self.loop.run_until_complete(self.run_events())
+        durations = self.loop.run_until_complete(self.run_playlists())
+        library = self.loop.run_until_complete(self.run_library())
+        browse = self.loop.run_until_complete(self.run_browse())
+        command_time, volume_sent = self.run_commands()
+        scene_time, scene_commands = self.loop.run_until_complete(self.run_scene())
+        resync = self.loop.run_until_complete(self.run_resync())
+        output_id_change = self.loop.run_until_complete(self.run_output_id_change())
+        removal = self.loop.run_until_complete(self.run_removal())
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.server.stop_roon()
+
+        print("zones: %s, outputs: %s, events: %s in %.2fs (%.0f/s)" % (
+            len(self.api.zones), len(self.devices), self.events, elapsed, self.events / elapsed))
+        print("state writes: %s (%.2f per event), skipped: %s" % (
+            self.writes, self.writes / max(self.events, 1), self.server.skipped_updates))
+        print("event -> state write latency: p50 %.1fms  p90 %.1fms  p99 %.1fms  max %.1fms" % (
+            percentile(self.latencies, 50) * 1000, percentile(self.latencies, 90) * 1000,
+            percentile(self.latencies, 99) * 1000, max(self.latencies or [0]) * 1000))
+        print("update_playlists: avg %.1fms  max %.1fms" % (
+            sum(durations) / max(len(durations), 1) * 1000, max(durations or [0]) * 1000))
+        print("commands: %s in %.2fs (%.0f/s), volume drag: 100 steps -> %s sent" % (
+            self.args.commands, command_time, self.args.commands / command_time, volume_sent))
+        items, index_time, index_requests, refresh_time, refresh_requests, lookups, play_time = library
+        print("library index: %s items in %.2fs (%s requests), refresh %.2fs (%s requests)" % (
+            items, index_time, index_requests, refresh_time, refresh_requests))
+        print("library lookup: p50 %.2fms  p99 %.2fms  max %.2fms, play resolved track: %.0fms" % (
+            percentile(lookups, 50) * 1000, percentile(lookups, 99) * 1000, max(lookups or [0]) * 1000,
+            play_time * 1000))
+        if browse:
+            albums, open_time, open_requests, back_time, back_requests, play_time = browse
+            print("media browser: open %s albums and next page %.0fms (%s requests), back to root %.2fms "
+                    "(%s requests), play album %.0fms" % (albums, open_time * 1000, open_requests, back_time * 1000,
+                    back_requests, play_time * 1000))
+        else:
+            print("media browser: needs Home Assistant 0.115 or newer")
+        print("scene (pause, volume, join %s players): %.2fs, %s roon requests" % (
+            len(self.devices), scene_time, scene_commands))
+        print("resync: %s zones, %s changed -> %s state writes, %s browse requests, %.1fms" % (
+            resync[0], resync[1], resync[2], resync[3], resync[4] * 1000))
+        print("output id change: player %s" % ("stays available" if output_id_change else "went OFFLINE"))
+        print("removal: zone with %s outputs removed -> %s players offline after %.0fms" % (
+            removal[0], removal[1], removal[2] * 1000))
+        print("peak memory: %.1f MB" % (peak_memory / 1024 / 1024))
+        if self.args.metrics:
+            for name, value in sorted(self.server.metrics.snapshot().items()):
+                print("  %s: %s" % (name, value))
+
+
+def get_parser():
+    ''' command line arguments'''
+    parser = argparse.ArgumentParser(description="Synthetic load benchmark for the Roon component")
+    parser.add_argument("--zones", type=int, default=20, help="number of zones")
+    parser.add_argument("--outputs", type=int, default=2, help="outputs per zone")
+    parser.add_argument("--events", type=int, default=2000, help="number of zone events")
+    parser.add_argument("--rate", type=float, default=500, help="events per second (0 = as fast as possible)")
+    parser.add_argument("--latency", type=float, default=0.01, help="simulated roonapi round-trip in seconds")
+    parser.add_argument("--commands", type=int, default=400, help="number of player commands")
+    parser.add_argument("--artists", type=int, default=100, help="artists in the library (5 albums, 50 tracks each)")
+    parser.add_argument("--playlist-passes", type=int, default=5, help="number of update_playlists passes")
+    parser.add_argument("--window", type=float, default=0.25, help="update window of the ingest stage")
+    parser.add_argument("--replay", metavar="TRACE", help="replay a recorded trace instead of synthetic events")
+    parser.add_argument("--realtime", action="store_true", help="replay at the recorded pace")
+    parser.add_argument("--record", metavar="TRACE", help="record the events of this run to a trace")
+    parser.add_argument("--metrics", action="store_true", help="print the metrics of the component")
+    parser.add_argument("--debug", action="store_true", help="enable debug logging")
+    return parser
+
+
+def main():
+    ''' run the benchmark'''
+    args = get_parser().parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+    Benchmark(load_component(), args).run()
+
+
+if __name__ == "__main__":
+    main()